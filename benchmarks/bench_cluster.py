@@ -0,0 +1,403 @@
+"""
+Local cluster simulator. Starts N nodes on localhost, as subprocesses or in this
+process, connects them through /nodes/register_with, drives transaction and mining
+load and reports block propagation time, time to consensus, fork rate and
+transactions per second as JSON.
+
+    python benchmarks/bench_cluster.py --nodes 4 --miners 2 --duration 30 --tx-rate 50
+    python benchmarks/bench_cluster.py --in-process --nodes 3 --latency 0.05 --failure-rate 0.1
+
+Peer latency and failures are injected by the nodes' PeerClient, see
+BLOCKCHAIN_PEER_LATENCY and BLOCKCHAIN_PEER_FAILURE_RATE in peers.py.
+"""
+from time import monotonic, sleep, time
+import argparse
+import importlib.util
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class SubprocessNode(object):
+    """
+    A node running server.py in its own Python process
+    """
+
+    def __init__(self, port, env):
+        self.address = f'127.0.0.1:{port}'
+        self.port = port
+        self.env = env
+        self.process = None
+
+    def start(self):
+        env = dict(os.environ, FLASK_APP='server.py', **self.env)
+        self.process = subprocess.Popen([sys.executable, '-m', 'flask', 'run', '--host', '127.0.0.1',
+                                         '--port', str(self.port)],
+                                        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class InProcessNode(object):
+    """
+    A node running its own copy of the server module on a thread of this process.
+    Cheaper to start than a subprocess, but the nodes share the GIL.
+    """
+    _ids = itertools.count()
+
+    def __init__(self, port, env):
+        self.address = f'127.0.0.1:{port}'
+        self.port = port
+        self.env = env
+        self.server = None
+
+    def start(self):
+        from werkzeug.serving import make_server
+
+        # the server module reads its configuration from the environment when loaded
+        os.environ.update(self.env)
+        sys.path.insert(0, ROOT)
+        spec = importlib.util.spec_from_file_location(f'cluster_node_{next(self._ids)}',
+                                                      os.path.join(ROOT, 'server.py'))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        # the peers module was imported once for all the nodes, before the environment was set
+        peers = module.blockchain.peers
+        peers.injected_latency = float(self.env.get('BLOCKCHAIN_PEER_LATENCY', 0))
+        peers.injected_failure_rate = float(self.env.get('BLOCKCHAIN_PEER_FAILURE_RATE', 0))
+        self.server = make_server('127.0.0.1', self.port, module.app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class TipObserver(object):
+    """
+    Polls the tip of every node and records when each node first reached each height
+    and which tips it went through
+    """
+
+    def __init__(self, nodes, interval):
+        self.nodes = nodes
+        self.interval = interval
+        self.session = requests.Session()
+        # address -> {height: first time the node's tip was at least that high}
+        self.reached = {node.address: {} for node in nodes}
+        # address -> {hash: height} of every tip the node went through
+        self.tips = {node.address: {} for node in nodes}
+        self.last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def poll(self):
+        now = monotonic()
+        for node in self.nodes:
+            try:
+                tip = self.session.get(f'http://{node.address}/chain/tip', timeout=2).json()
+            except (requests.RequestException, ValueError):
+                continue
+            reached = self.reached[node.address]
+            for height in range(max(reached, default=0) + 1, tip['height'] + 1):
+                reached[height] = now
+            self.tips[node.address][tip['hash']] = tip['height']
+            self.last[node.address] = tip
+        return self.last
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(self.interval)
+
+
+def wait_ready(nodes, timeout):
+    deadline = monotonic() + timeout
+    for node in nodes:
+        while True:
+            try:
+                requests.get(f'http://{node.address}/chain/tip', timeout=1)
+                break
+            except requests.RequestException:
+                if monotonic() > deadline:
+                    raise SystemExit(f'node {node.address} did not start')
+                sleep(0.1)
+
+
+def connect(nodes, topology):
+    """
+    Every node registers with the first one, in a mesh every node also learns about all the others
+    """
+    seed = nodes[0]
+    for node in nodes[1:]:
+        response = requests.post(f'http://{node.address}/nodes/register_with',
+                                 json={'node': f'http://{seed.address}'}, timeout=30)
+        if response.status_code != 201:
+            raise SystemExit(f'{node.address} could not register with {seed.address}: {response.text}')
+    if topology == 'mesh':
+        for node in nodes:
+            others = [f'http://{other.address}' for other in nodes if other is not node]
+            requests.post(f'http://{node.address}/nodes/register', json={'nodes': others}, timeout=30)
+
+
+class TransactionLoad(object):
+    """
+    Submits payments to the nodes round robin at a target rate
+    """
+
+    def __init__(self, nodes, rate, batch, amount, threads):
+        self.nodes = nodes
+        self.rate = rate
+        self.batch = batch
+        self.amount = amount
+        self.threads = threads
+        self.accepted = 0
+        self.rejected = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._workers = []
+        self._sequence = itertools.count()
+
+    def start(self):
+        if self.rate <= 0:
+            return
+        self._workers = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(self.threads)]
+        for worker in self._workers:
+            worker.start()
+
+    def stop(self):
+        self._stop.set()
+        for worker in self._workers:
+            worker.join()
+
+    def _submit(self, session, node):
+        payments = [{'receiver': f'sim-{next(self._sequence)}', 'amount': self.amount} for _ in range(self.batch)]
+        if self.batch == 1:
+            response = session.post(f'http://{node.address}/transactions/new', json=payments[0], timeout=10)
+            return (1, 0) if response.status_code == 201 else (0, 1)
+        response = session.post(f'http://{node.address}/transactions/batch', json={'transactions': payments},
+                                timeout=30)
+        if response.status_code not in (201, 400):
+            return 0, len(payments)
+        accepted = response.json().get('accepted', 0) if response.status_code == 201 else 0
+        return accepted, len(payments) - accepted
+
+    def _run(self, worker):
+        session = requests.Session()
+        # every worker submits its share of the requests per second
+        period = self.threads * self.batch / self.rate
+        next_at = monotonic()
+        for node in itertools.islice(itertools.cycle(self.nodes), worker, None):
+            if self._stop.is_set():
+                return
+            try:
+                accepted, rejected = self._submit(session, node)
+            except requests.RequestException:
+                with self._lock:
+                    self.errors += 1
+            else:
+                with self._lock:
+                    self.accepted += accepted
+                    self.rejected += rejected
+            next_at += period
+            self._stop.wait(max(0.0, next_at - monotonic()))
+
+
+def fetch_json(address, path, timeout=30):
+    return requests.get(f'http://{address}{path}', headers={'Accept': 'application/json'}, timeout=timeout).json()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {'count': len(values), 'mean': statistics.mean(values), 'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95), 'max': max(values)}
+
+
+def wait_consensus(nodes, observer, settle, resolve_after):
+    """
+    Waits until every node has the same tip. Nodes that did not converge on their own
+    are asked to resolve conflicts every resolve_after seconds, a sync can fail
+    when peer failures are injected.
+    :return: <tuple> (seconds to consensus or None, number of /nodes/resolve rounds)
+    """
+    started = monotonic()
+    next_resolve = started + resolve_after
+    rounds = 0
+    while monotonic() - started < settle:
+        tips = observer.poll()
+        if len(tips) == len(nodes) and len({tip['hash'] for tip in tips.values()}) == 1:
+            return monotonic() - started, rounds
+        if monotonic() >= next_resolve:
+            for node in nodes:
+                try:
+                    requests.get(f'http://{node.address}/nodes/resolve', timeout=30)
+                except requests.RequestException:
+                    pass
+            rounds += 1
+            next_resolve = monotonic() + resolve_after
+        sleep(observer.interval)
+    return None, rounds
+
+
+def run(args):
+    env = {
+        'BLOCKCHAIN_DIFFICULTY': str(args.difficulty),
+        'BLOCKCHAIN_MINER_WORKERS': str(args.miner_workers),
+        'BLOCKCHAIN_PEER_LATENCY': str(args.latency),
+        'BLOCKCHAIN_PEER_FAILURE_RATE': str(args.failure_rate),
+    }
+    node_class = InProcessNode if args.in_process else SubprocessNode
+    nodes = []
+    for i in range(args.nodes):
+        port = args.base_port + i
+        node = node_class(port, dict(env, BLOCKCHAIN_NODE_ADDRESS=f'127.0.0.1:{port}'))
+        nodes.append(node)
+
+    observer = TipObserver(nodes, args.poll_interval)
+    load = TransactionLoad(nodes, args.tx_rate, args.batch, args.amount, args.tx_threads)
+    miners = nodes[:args.miners]
+    try:
+        for node in nodes:
+            node.start()
+        wait_ready(nodes, args.startup_timeout)
+        connect(nodes, args.topology)
+        start_height = max(tip['height'] for tip in observer.poll().values())
+
+        # load phase
+        observer.start()
+        started = monotonic()
+        for node in miners:
+            requests.post(f'http://{node.address}/mine/start', timeout=10)
+        load.start()
+        sleep(args.duration)
+        load.stop()
+        for node in miners:
+            requests.post(f'http://{node.address}/mine/stop', timeout=10)
+        load_seconds = monotonic() - started
+        observer.stop()
+
+        consensus_seconds, resolve_rounds = wait_consensus(nodes, observer, args.settle, args.resolve_after)
+
+        # the chain every node agreed on, or the first node's when they did not
+        reference = nodes[0].address
+        headers = fetch_json(reference, f'/chain?from={start_height + 1}&headers=1')['chain']
+        blocks = fetch_json(reference, f'/chain?from={start_height + 1}')['chain']
+    finally:
+        for node in nodes:
+            node.stop()
+
+    final_hashes = {header['hash'] for header in headers}
+    new_heights = [header['index'] for header in headers]
+
+    # propagation: from the first node reaching a height to the last one reaching it
+    propagation = []
+    for height in new_heights:
+        times = [observer.reached[node.address].get(height) for node in nodes]
+        if all(t is not None for t in times):
+            propagation.append(max(times) - min(times))
+
+    # tips seen above the starting height that did not end up in the agreed chain
+    seen = {}
+    for tips in observer.tips.values():
+        seen.update({h: height for h, height in tips.items() if height > start_height})
+    stale = [h for h in seen if h not in final_hashes]
+
+    confirmed = sum(1 for block in blocks for tr in block['transactions'] if tr['sender'] != 'System')
+    return {
+        'meta': {
+            'timestamp': time(),
+            'mode': 'in-process' if args.in_process else 'subprocess',
+            'nodes': args.nodes,
+            'miners': args.miners,
+            'topology': args.topology,
+            'difficulty': args.difficulty,
+            'duration': args.duration,
+            'tx_rate': args.tx_rate,
+            'batch': args.batch,
+            'latency': args.latency,
+            'failure_rate': args.failure_rate,
+            'poll_interval': args.poll_interval,
+            'cpus': os.cpu_count()
+        },
+        'results': {
+            'blocks': len(headers),
+            'block_interval_seconds': load_seconds / len(headers) if headers else None,
+            'propagation_seconds': summarize(propagation),
+            'consensus_seconds': consensus_seconds,
+            'converged': consensus_seconds is not None,
+            'resolve_rounds': resolve_rounds,
+            'stale_tips': len(stale),
+            'fork_rate': len(stale) / (len(stale) + len(headers)) if headers or stale else 0.0,
+            'transactions_accepted': load.accepted,
+            'transactions_rejected': load.rejected,
+            'transaction_errors': load.errors,
+            'accepted_per_sec': load.accepted / load_seconds,
+            'transactions_confirmed': confirmed,
+            'confirmed_per_sec': confirmed / load_seconds
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--miners', type=int, default=1, help='nodes mining continuously')
+    parser.add_argument('--in-process', action='store_true', help='run the nodes on threads of this process')
+    parser.add_argument('--topology', choices=('star', 'mesh'), default='mesh')
+    parser.add_argument('--base-port', type=int, default=5100)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load')
+    parser.add_argument('--difficulty', type=int, default=4)
+    parser.add_argument('--miner-workers', type=int, default=1, help='mining processes per node')
+    parser.add_argument('--tx-rate', type=float, default=20.0, help='transactions per second over all the nodes')
+    parser.add_argument('--tx-threads', type=int, default=4)
+    parser.add_argument('--batch', type=int, default=1, help='transactions per request, more than 1 uses /transactions/batch')
+    parser.add_argument('--amount', type=float, default=0.001)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every peer request')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='share of the peer requests failing')
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--settle', type=float, default=30.0, help='seconds to wait for consensus after the load')
+    parser.add_argument('--resolve-after', type=float, default=5.0,
+                        help='seconds without consensus between calls to /nodes/resolve on every node')
+    parser.add_argument('--startup-timeout', type=float, default=30.0)
+    parser.add_argument('--output', help='file the JSON report is written to, stdout by default')
+    args = parser.parse_args()
+    if args.miners > args.nodes:
+        parser.error('--miners cannot exceed --nodes')
+
+    output = json.dumps(run(args), indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Micro-benchmark of the proof of work hashing kernel against the original
+one nonce at a time loop.
+
+    python benchmarks/bench_pow.py --difficulty 4 --nonces 500000
+"""
+from time import perf_counter
+import argparse
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashkernel
+
+
+def reference_search(last_proof, start, stop, difficulty):
+    # the loop Blockchain.proof_of_work used before the kernel
+    for proof in range(start, stop):
+        guess_hash = hashlib.sha256(f'{last_proof}{proof}'.encode()).hexdigest()
+        if guess_hash[:difficulty] == '0' * difficulty:
+            return proof
+    return None
+
+
+def kernel_search(last_proof, start, stop, difficulty):
+    return hashkernel.search(last_proof, start, stop, difficulty)[0]
+
+
+def measure(search, last_proof, nonces, difficulty, repeat):
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        search(last_proof, 0, nonces, difficulty)
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return nonces / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--difficulty', type=int, default=4)
+    parser.add_argument('--nonces', type=int, default=500000)
+    parser.add_argument('--last-proof', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # an unreachable difficulty makes both loops scan every nonce
+    difficulty = 64
+    for lp in range(args.last_proof, args.last_proof + 20):
+        if reference_search(lp, 0, 20000, args.difficulty) != kernel_search(lp, 0, 20000, args.difficulty):
+            raise SystemExit(f'kernel and reference disagree for last_proof {lp}')
+
+    reference = measure(reference_search, args.last_proof, args.nonces, difficulty, args.repeat)
+    kernel = measure(kernel_search, args.last_proof, args.nonces, difficulty, args.repeat)
+    print(f'reference loop: {reference:,.0f} hashes/sec')
+    print(f'hash kernel:    {kernel:,.0f} hashes/sec')
+    print(f'speedup:        {kernel / reference:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
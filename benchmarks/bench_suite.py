@@ -0,0 +1,338 @@
+"""
+Benchmark suite of the node's hot paths: proof of work, block hashing, chain
+validation, transaction signatures and the HTTP API (through the Flask test client).
+Results are written as JSON so runs on different commits can be compared.
+
+    python benchmarks/bench_suite.py --output results.json
+    python benchmarks/bench_suite.py --quick --only pow,api
+    python benchmarks/bench_suite.py --compare baseline.json --output results.json
+"""
+from time import perf_counter, time
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import hashkernel
+import wire
+from blockchain import Block, Blockchain, Transaction
+from verifier import load_private_key
+
+# private value of the wallet signing the benchmark transactions
+PRIVATE_VALUE = 4242
+
+
+def best_of(fn, repeat):
+    """
+    :param fn: callable to time
+    :param repeat: <int> number of runs
+    :return: <float> fastest run in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        started = perf_counter()
+        fn()
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def latency_stats(samples):
+    """
+    :param samples: <list> of durations in seconds
+    :return: <dict> latencies in milliseconds and requests per second
+    """
+    ordered = sorted(samples)
+    return {
+        'requests': len(samples),
+        'mean_ms': statistics.mean(samples) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'per_sec': len(samples) / sum(samples)
+    }
+
+
+def reward(receiver, amount=1, timestamp=None):
+    return Transaction.create('System', receiver, amount, timestamp=timestamp)
+
+
+def signed_transactions(count, receiver='bench-receiver'):
+    sender = load_private_key(PRIVATE_VALUE)[1]
+    transactions = []
+    for i in range(count):
+        transactions.append(Transaction.create(sender, receiver, 1, PRIVATE_VALUE, 1700000000.0 + i))
+    return transactions
+
+
+def synthetic_chain(length, transactions_per_block=1, difficulty=1):
+    """
+    Builds a valid chain of the given length at a low difficulty, so that generating
+    it stays cheap while validating it exercises every check
+    :return: <list> of Block, genesis block first
+    """
+    blocks = [Block(index=1, timestamp=1700000000.0, transaction=[], proof=100, previous_hash=1)]
+    for index in range(2, length + 1):
+        last_block = blocks[-1]
+        proof, _ = hashkernel.search(last_block.proof, 0, 1 << 32, difficulty)
+        transactions = [reward(f'miner-{index % 16}', 1, 1700000000.0 + index + i / 1000)
+                        for i in range(transactions_per_block)]
+        blocks.append(Block(index=index, timestamp=1700000000.0 + index, transaction=transactions,
+                            proof=proof, previous_hash=last_block.hash))
+    return blocks
+
+
+def bench_pow(args):
+    """
+    Hashes per second of proof_of_work, single process and with the parallel miner
+    """
+    results = {}
+    blockchain = Blockchain()
+    saved = Blockchain.difficulty
+    try:
+        for difficulty in args.difficulties:
+            Blockchain.difficulty = difficulty
+            hashes = 0
+            started = perf_counter()
+            for last_proof in range(100, 100 + args.pow_rounds):
+                # the search starts at nonce 0, so it tried proof + 1 nonces
+                hashes += blockchain.proof_of_work(last_proof) + 1
+            elapsed = perf_counter() - started
+            results[f'difficulty_{difficulty}'] = {'rounds': args.pow_rounds, 'hashes': hashes,
+                                                   'seconds': elapsed, 'hashes_per_sec': hashes / elapsed}
+
+        if not args.quick:
+            from miner import ParallelMiner
+            miner = ParallelMiner()
+            difficulty = max(args.difficulties)
+            hashes = 0
+            started = perf_counter()
+            for last_proof in range(100, 100 + args.pow_rounds):
+                miner.mine(last_proof, difficulty)
+                hashes += miner.last_hashes
+            elapsed = perf_counter() - started
+            results[f'parallel_difficulty_{difficulty}'] = {'workers': miner.workers, 'rounds': args.pow_rounds,
+                                                            'hashes': hashes, 'seconds': elapsed,
+                                                            'hashes_per_sec': hashes / elapsed}
+    finally:
+        Blockchain.difficulty = saved
+    return results
+
+
+def bench_block_hash(args):
+    """
+    Blockchain.hash of blocks with a growing number of transactions, the hash
+    cache is bypassed by hashing fresh copies of the block
+    """
+    results = {}
+    transactions = signed_transactions(max(args.block_sizes))
+    for size in args.block_sizes:
+        details = Block(index=2, timestamp=1700000000.0, transaction=transactions[:size],
+                        proof=1, previous_hash='00' * 32).get_details()
+        copies = [Block.from_details(details) for _ in range(args.hash_copies)]
+        elapsed = best_of(lambda: [Blockchain.hash(block) for block in copies], 1)
+        results[f'{size}_transactions'] = {'blocks': len(copies), 'seconds': elapsed,
+                                           'us_per_block': elapsed / len(copies) * 1e6}
+    return results
+
+
+def bench_valid_chain(args):
+    """
+    valid_chain over synthetic chains, from scratch and sharing a checkpoint near the tip
+    """
+    results = {}
+    saved = Blockchain.difficulty
+    Blockchain.difficulty = 1
+    try:
+        for length in args.chain_lengths:
+            blocks = synthetic_chain(length, args.chain_transactions, 1)
+            # validated in wire form, as a chain received from a peer, so every block gets hashed
+            details = [block.get_details() for block in blocks]
+            validator = Blockchain()
+            elapsed = best_of(lambda: validator.valid_chain(details), args.repeat)
+            if not validator.valid_chain(details):
+                raise SystemExit(f'synthetic chain of {length} blocks is not valid')
+            results[f'{length}_blocks'] = {'seconds': elapsed, 'blocks_per_sec': length / elapsed}
+
+            # a validator that already accepted all but the last blocks
+            checkpoint = length - args.checkpoint_distance
+            validator.checkpoints[checkpoint] = blocks[checkpoint - 1].hash
+            elapsed = best_of(lambda: validator.valid_chain(details), args.repeat)
+            results[f'{length}_blocks_checkpoint'] = {'new_blocks': args.checkpoint_distance, 'seconds': elapsed}
+    finally:
+        Blockchain.difficulty = saved
+    return results
+
+
+def bench_signatures(args):
+    """
+    Transaction.create with signing and is_valid throughput
+    """
+    count = args.signatures
+    elapsed_sign = best_of(lambda: signed_transactions(count), 1)
+    transactions = signed_transactions(count)
+    elapsed_verify = best_of(lambda: [t.is_valid() for t in transactions], args.repeat)
+    if not all(t.is_valid() for t in transactions):
+        raise SystemExit('benchmark transactions do not verify')
+    return {
+        'sign': {'transactions': count, 'seconds': elapsed_sign, 'per_sec': count / elapsed_sign},
+        'is_valid': {'transactions': count, 'seconds': elapsed_verify, 'per_sec': count / elapsed_verify}
+    }
+
+
+def bench_api(args):
+    """
+    Latency and throughput of /chain, /transactions/new and /blocks/add through the Flask test client
+    """
+    import server
+
+    blockchain = server.blockchain
+    client = server.app.test_client()
+    saved = Blockchain.difficulty
+    Blockchain.difficulty = 1
+    try:
+        # fund the node wallet and grow the chain to the benchmark length
+        blockchain.new_block(transaction=[reward(server.node_wallet_id, 10 ** 9)],
+                             proof=hashkernel.search(blockchain.last_block.proof, 0, 1 << 32, 1)[0])
+        while len(blockchain.chain) < args.api_chain_length:
+            last_block = blockchain.last_block
+            blockchain.new_block(transaction=[reward(server.node_wallet_id)],
+                                 proof=hashkernel.search(last_block.proof, 0, 1 << 32, 1)[0])
+
+        results = {}
+        samples = []
+        for _ in range(args.api_requests):
+            started = perf_counter()
+            response = client.get('/chain')
+            response.get_data()
+            samples.append(perf_counter() - started)
+            assert response.status_code == 200, response.status_code
+        results['get_chain'] = dict(latency_stats(samples), chain_length=len(blockchain.chain))
+
+        samples = []
+        for i in range(args.api_requests):
+            started = perf_counter()
+            response = client.post('/transactions/new', json={'receiver': f'bench-{i}', 'amount': 1})
+            samples.append(perf_counter() - started)
+            assert response.status_code == 201, response.get_data(as_text=True)
+        results['post_transaction'] = latency_stats(samples)
+
+        # a run of blocks extending the tip, pushed in the binary wire format like peers do
+        blocks = []
+        last_block = blockchain.last_block
+        for i in range(args.api_requests):
+            proof, _ = hashkernel.search(last_block.proof, 0, 1 << 32, 1)
+            last_block = Block(index=last_block.index + 1, timestamp=time() + i,
+                               transaction=[reward('bench-peer')], proof=proof, previous_hash=last_block.hash)
+            blocks.append(last_block)
+        samples = []
+        for block in blocks:
+            payload = wire.encode_block(block.get_details())
+            started = perf_counter()
+            response = client.post('/blocks/add', data=payload, headers={'Content-Type': wire.CONTENT_TYPE})
+            samples.append(perf_counter() - started)
+            assert response.status_code == 201, response.get_data(as_text=True)
+        results['post_block'] = latency_stats(samples)
+    finally:
+        Blockchain.difficulty = saved
+    return results
+
+
+BENCHMARKS = {
+    'pow': bench_pow,
+    'block_hash': bench_block_hash,
+    'valid_chain': bench_valid_chain,
+    'signatures': bench_signatures,
+    'api': bench_api,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    # {'a': {'b': 1}} -> {'a.b': 1}, only numbers are kept
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(baseline, current):
+    """
+    Prints the ratio of every measurement to the baseline run
+    """
+    base = flatten(baseline['results'])
+    for key, value in sorted(flatten(current['results']).items()):
+        if key in base and base[key]:
+            print(f'{key:60} {base[key]:14.3f} -> {value:14.3f}  ({value / base[key]:.2f}x)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help='comma separated benchmarks to run: ' + ','.join(BENCHMARKS))
+    parser.add_argument('--quick', action='store_true', help='smaller workloads, for a smoke run')
+    parser.add_argument('--output', help='file the JSON results are written to, stdout by default')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare against')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    args.difficulties = [2, 3, 4] if args.quick else [2, 3, 4, 5]
+    args.pow_rounds = 5 if args.quick else 20
+    args.block_sizes = [1, 10, 100] if args.quick else [1, 10, 100, 1000]
+    args.hash_copies = 20 if args.quick else 100
+    args.chain_lengths = [1000] if args.quick else [1000, 10000, 100000]
+    args.chain_transactions = 1
+    args.checkpoint_distance = 10
+    args.signatures = 100 if args.quick else 1000
+    args.api_chain_length = 100 if args.quick else 1000
+    args.api_requests = 50 if args.quick else 500
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+
+    report = {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'quick': args.quick
+        },
+        'results': {}
+    }
+    for name in names:
+        print(f'running {name}', file=sys.stderr)
+        report['results'][name] = BENCHMARKS[name](args)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,74 +1,219 @@
-from time import time
+from functools import wraps
+from time import perf_counter, time
 import hashlib
 import json
-from urllib.parse import urlparse
-import requests
-from cryptography.hazmat.primitives.asymmetric import ec
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.serialization import Encoding
-from cryptography.hazmat.primitives.serialization import PublicFormat
-from cryptography.hazmat.primitives.asymmetric.ec import EllipticCurvePublicKey
-import cryptography.exceptions
+import logging
+import sys
+import threading
+import hashkernel
+import merkle
+import metrics
+import wire
+from blockstore import StoredChain
+from peers import PeerClient
+from mempool import DuplicateTransaction, Mempool, MempoolFull
+from blocktree import BlockTree
+from chainindex import ChainIndex
+from ledger import InsufficientFunds, Ledger, amount_of
+from verifier import SignatureVerifier, sign_payload, signing_payload, verify_signature
+
+
+logger = logging.getLogger(__name__)
+
+# sets the fields of the immutable records below
+_set = object.__setattr__
+
+
+def intern_address(address):
+    """
+    Wallet addresses repeat in every transaction of a wallet, interning them keeps
+    a single copy of each address however many transactions refer to it
+    :param address: <str> wallet address, or 'System'
+    :return: the interned address
+    """
+    return sys.intern(address) if type(address) is str else address
+
+
+def _field(details, name, kinds, description):
+    """
+    Reads a field of a record received from a peer, checking its type
+    :raises ValueError: if the field has another type
+    """
+    value = details[name]
+    if isinstance(value, bool) or not isinstance(value, kinds):
+        raise ValueError(f'{name} must be {description}, got {value!r}')
+    return value
+
+
+def _unsigned(details, name):
+    value = _field(details, name, int, 'an unsigned integer')
+    if not 0 <= value < 2 ** 64:
+        raise ValueError(f'{name} must be an unsigned integer, got {value!r}')
+    return value
 
 
 class Transaction(object):
-    def __init__(self):
-        self.sender = ""
-        self.receiver = ""
-        self.amount = ""
+    """
+    Slotted, immutable transaction record. All of its fields, the signature included, are set
+    when it is built, by create or from_details, so its ID and the hash and merkle leaves
+    cached by the blocks holding it never go stale.
+    The addresses are interned and the signature is kept as raw bytes.
+    """
+    __slots__ = ('sender', 'receiver', 'amount', 'timestamp', 'signature')
+
+    def __init__(self, sender, receiver, amount, timestamp=None, signature=None):
+        _set(self, 'sender', intern_address(sender))
+        _set(self, 'receiver', intern_address(receiver))
+        _set(self, 'amount', amount)
+        _set(self, 'timestamp', timestamp or time())
+        _set(self, 'signature', signature)
 
-    def set_transaction(self, sender, receiver, amount):
-        self.sender = sender
-        self.receiver = receiver
-        self.amount = amount
+    def __setattr__(self, name, value):
+        raise AttributeError(f'Transaction fields are read only, cannot set {name}')
+
+    @classmethod
+    def create(cls, sender, receiver, amount, private_value=None, timestamp=None):
+        """
+        Builds a new transaction, signed unless it is paid by 'System'
+        :param sender: Address of sender <str>
+        :param receiver: Address of receiver <str>
+        :param amount: amount transferred <int>
+        :param private_value: private value of the sender's wallet, the transaction is left unsigned without it
+        :param timestamp: defaults to now
+        :return: <Transaction>
+        """
+        transaction = cls(sender, receiver, amount, timestamp)
+        if private_value and sender != 'System':
+            # the key is derived once per private value and cached
+            _set(transaction, 'signature',
+                 sign_payload(private_value, transaction.sender, transaction.get_data_bytes()))
+        return transaction
+
+    @classmethod
+    def from_details(cls, details):
+        """
+        Builds a transaction from its get_details() form
+        :param details: <dict>
+        :return: <Transaction>
+        :raises ValueError: if a field has the wrong type
+        """
+        signature = details.get('signature')
+        if signature is not None and not isinstance(signature, str):
+            raise ValueError(f'signature must be hex, got {signature!r}')
+        return cls(_field(details, 'sender', str, 'an address'),
+                   _field(details, 'receiver', str, 'an address'),
+                   _field(details, 'amount', (int, float), 'a number'),
+                   _field(details, 'timestamp', (int, float), 'a number'),
+                   bytes.fromhex(signature) if signature else None)
 
     def get_details(self):
         return {
             'sender': self.sender,
             'receiver': self.receiver,
-            'amount': self.amount
+            'amount': self.amount,
+            'timestamp': self.timestamp,
+            'signature': self.signature.hex() if self.signature else None
         }
 
     def get_data_bytes(self):
-        return b'{self.sender}{self.receiver}{self.amount}'
-
-    def sign_transaction(self, private_value):
-        private_key_obj = ec.derive_private_key(private_value, ec.SECP256K1(), default_backend())
-        pub_key = private_key_obj.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo).hex()
+        return signing_payload(self.sender, self.receiver, self.amount, self.timestamp)
 
-        if pub_key != self.sender:
-            raise Exception('You cannot sign transactions for other wallets')
-
-        data = self.get_data_bytes()
-        self.signature = private_key_obj.sign(data, ec.ECDSA(hashes.SHA256()))
-        return self.signature
+    @property
+    def id(self):
+        """
+        Transaction ID, the SHA-256 of the signed payload
+        :return: <str>
+        """
+        return hashlib.sha256(self.get_data_bytes()).hexdigest()
 
     def is_valid(self):
         if self.sender == 'System':
             return True
         if self.signature is None or len(self.signature) == 0:
-            print('ERROR: No signature found in the transaction')
+            logger.debug('Transaction %s has no signature', self.id)
             return False
 
-        # generate a pub key obj from the sender info
-        pub_key_obj = EllipticCurvePublicKey.from_encoded_point(ec.SECP256K1(), bytes.fromhex(self.sender))
-        data = self.get_data_bytes()
-        try:
-            pub_key_obj.verify(self.signature, data, ec.ECDSA(hashes.SHA256()))
-        except cryptography.exceptions.InvalidSignature as exp:
-            print(exp)
+        # the pub key obj of the sender is parsed once and cached
+        if not verify_signature(self.sender, self.get_data_bytes(), self.signature):
+            logger.debug('Transaction %s has an invalid signature', self.id)
             return False
         return True
 
 
+def canonical_json(obj):
+    """
+    Deterministic JSON encoding used for everything that gets hashed
+    :param obj: JSON serializable object
+    :return: <bytes>
+    """
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode()
+
+
+def transaction_leaf(details):
+    """
+    Merkle leaf of a transaction, covering all of its fields including the signature
+    :param details: <dict> get_details() of the transaction
+    :return: <bytes>
+    """
+    return merkle.leaf_hash(canonical_json(details))
+
+
+def header_hash(header):
+    """
+    SHA-256 of the canonical encoding of a block header, lets light clients
+    check a chain of headers without the block bodies
+    :param header: <dict> as returned by Block.get_header()
+    :return: <str>
+    """
+    fields = {k: header[k] for k in ('index', 'timestamp', 'merkle_root', 'proof', 'previous_hash')}
+    return hashlib.sha256(canonical_json(fields)).hexdigest()
+
+
+def serialized(method):
+    """
+    Runs a Blockchain method under the chain's write lock, so the chain, the ledger,
+    the block tree and the pending pool change as a whole for concurrent requests
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class Block(object):
+    """
+    Slotted, immutable block record, so its hash and merkle leaves can be computed once
+    """
+    __slots__ = ('index', 'timestamp', 'transaction', 'proof', 'previous_hash', '_hash', '_leaves')
+
     def __init__(self, index, timestamp, transaction, proof, previous_hash=None):
-        self.index = index
-        self.timestamp = timestamp or time()
-        self.transaction = transaction
-        self.proof = proof
-        self.previous_hash = previous_hash
+        _set(self, 'index', index)
+        _set(self, 'timestamp', timestamp or time())
+        _set(self, 'transaction', tuple(transaction))
+        _set(self, 'proof', proof)
+        _set(self, 'previous_hash', previous_hash)
+        _set(self, '_hash', None)
+        # merkle leaves of the transactions, concatenated
+        _set(self, '_leaves', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'Block fields are read only, cannot set {name}')
+
+    @classmethod
+    def from_details(cls, details):
+        """
+        Builds a block from its get_details() form, e.g. a block received from a peer
+        :param details: <dict>
+        :return: <Block>
+        :raises ValueError: if a field has the wrong type
+        """
+        index = _unsigned(details, 'index')
+        # the genesis block has no previous hash, it holds 1 instead
+        previous_hash = _field(details, 'previous_hash', (str, int) if index == 1 else str, 'a hash')
+        return cls(index=index, timestamp=_field(details, 'timestamp', (int, float), 'a number'),
+                   transaction=[Transaction.from_details(tr) for tr in _field(details, 'transactions', list, 'a list')],
+                   proof=_unsigned(details, 'proof'), previous_hash=previous_hash)
 
     def get_details(self):
         return {
@@ -79,6 +224,60 @@ class Block(object):
             'previous_hash': self.previous_hash
         }
 
+    @property
+    def leaves(self):
+        """
+        Merkle leaves of the transactions, computed once per block and kept
+        as one bytes object rather than a list of small ones
+        :return: <list> of <bytes>
+        """
+        leaves = self._leaves
+        if leaves is None:
+            leaves = b''.join(transaction_leaf(t.get_details()) for t in self.transaction)
+            _set(self, '_leaves', leaves)
+        return [leaves[i:i + 32] for i in range(0, len(leaves), 32)]
+
+    @property
+    def merkle_root(self):
+        return merkle.merkle_root(self.leaves)
+
+    def get_header(self):
+        """
+        Fixed size set of fields the block hash is computed over, the transactions
+        are committed to through their merkle root
+        :return: <dict>
+        """
+        return {
+            'index': self.index,
+            'timestamp': self.timestamp,
+            'merkle_root': self.merkle_root,
+            'proof': self.proof,
+            'previous_hash': self.previous_hash
+        }
+
+    def get_transaction_proof(self, transaction_id):
+        """
+        Inclusion proof of one of the block's transactions
+        :param transaction_id: <str>
+        :return: <list> as returned by merkle.merkle_proof, or None if the transaction is not in the block
+        """
+        for position, tr in enumerate(self.transaction):
+            if tr.id == transaction_id:
+                return merkle.merkle_proof(self.leaves, position)
+        return None
+
+    @property
+    def hash(self):
+        """
+        SHA-256 of the canonical header encoding, computed once per block
+        :return: <str>
+        """
+        block_hash = self._hash
+        if block_hash is None:
+            block_hash = header_hash(self.get_header())
+            _set(self, '_hash', block_hash)
+        return block_hash
+
     def has_valid_transaction(self):
         for tr in self.transaction:
             if not tr.is_valid():
@@ -92,13 +291,57 @@ class Blockchain(object):
     # mining reward given for mining blocks
     mining_reward = 1
 
-    def __init__(self):
-        self.chain = []
-        self.currentTransactions = []
+    # nonces scanned per call to the hashing kernel
+    pow_batch = 100000
+
+    # headers compared in the first round of the common ancestor search
+    sync_window = 16
+
+    # blocks requested per call while downloading from a peer
+    sync_page_size = 500
+
+    # side branch blocks deeper than this below our tip are forgotten
+    max_reorg_depth = 100
+
+    # every checkpoint_interval-th block of our chain is recorded as a trusted checkpoint,
+    # candidate chains sharing it are only validated after it
+    checkpoint_interval = 100
+
+    # size limit of the blocks we assemble from the pending transactions
+    block_max_transactions = 1000
+    block_max_bytes = 1024 * 1024
+
+    def __init__(self, miner=None, store=None, peers=None, verifier=None, mempool=None):
+        """
+        :param miner: optional <ParallelMiner> used by proof_of_work
+        :param store: optional <BlockStore>, the chain is reopened from it and new blocks are persisted to it
+        :param peers: optional <PeerClient> used to talk to the other nodes
+        :param verifier: optional <SignatureVerifier> checking the transactions of received blocks
+        :param mempool: optional <Mempool> holding the pending transactions
+        """
+        self.chain = [] if store is None else StoredChain(store, Block.from_details)
+        self.miner = miner
+        self.peers = peers or PeerClient()
+        self.verifier = verifier or SignatureVerifier()
+        self.mempool = mempool or Mempool()
+        self.tree = BlockTree()
+        self._ledger = None
+        self._chain_index = None
+        # single writer, every change of the chain goes through it
+        self.lock = threading.RLock()
+        # callables invoked with the new last block whenever our tip changes
+        self.tip_listeners = []
+        # callables invoked with every transaction this node creates, once it is pending
+        self.transaction_listeners = []
         self.nodes = set()
         self._chain_len = len(self.chain)
-        # genesis block
-        self.create_genesis_block()
+        # height -> hash of the blocks of our chain we validated and use as checkpoints
+        self.checkpoints = {height: self._main_hash(height)
+                            for height in range(self.checkpoint_interval, len(self.chain) + 1,
+                                                self.checkpoint_interval)}
+        # genesis block, unless the chain was reopened from the store
+        if len(self.chain) == 0:
+            self.create_genesis_block()
 
     def create_genesis_block(self):
         """
@@ -110,25 +353,103 @@ class Blockchain(object):
     def __len__(self):
         return self._chain_len
 
+    @serialized
     def new_block(self, index=None, timestamp=None, transaction=None, proof=None, previous_hash=None):
         """
         Creates new block in the blockchain
         :param timestamp:
         :param index:
-        :param transaction:
+        :param transaction: transactions of the block, defaults to the top pending transactions
+                            up to the block size limit
         :param proof: proof given by proof of work algo <int>
         :param previous_hash: Hash of previous block <str>
         :return: new Block <dict>
         """
         new_block = Block(index=index or len(self.chain) + 1, timestamp=timestamp,
-                          transaction=transaction or self.currentTransactions,
-                          proof=proof, previous_hash=previous_hash or self.hash(self.chain[-1]))
+                          transaction=transaction or self.select_transactions(self.block_max_transactions,
+                                                                              self.block_max_bytes),
+                          proof=proof, previous_hash=previous_hash or self.last_block.hash)
 
-        self.chain.append(new_block)
-        # reset current transactions after adding new block
-        self.currentTransactions = []
+        self._append_block(new_block)
         return new_block
 
+    def _append_block(self, block):
+        """
+        Appends a block to the chain and updates the state derived from it:
+        its transactions leave the pending pool and the ledger applies them
+        """
+        self.chain.append(block)
+        if block.index % self.checkpoint_interval == 0:
+            self.checkpoints[block.index] = block.hash
+        self.mempool.remove_many(tr.id for tr in block.transaction)
+        if self._ledger is not None:
+            self._ledger.apply_block(block)
+        if self._chain_index is not None:
+            self._chain_index.apply_block(block)
+        self._notify_tip()
+
+    @serialized
+    def _truncate(self, length):
+        """
+        Drops the blocks after the first length blocks, reverting them from the ledger and the index tip first
+        """
+        if self._ledger is not None or self._chain_index is not None:
+            for position in range(len(self.chain) - 1, length - 1, -1):
+                block = self.chain[position]
+                if self._ledger is not None:
+                    self._ledger.revert_block(block)
+                if self._chain_index is not None:
+                    self._chain_index.revert_block(block)
+        del self.chain[length:]
+        for height in [h for h in self.checkpoints if h > length]:
+            del self.checkpoints[height]
+        self._notify_tip()
+
+    def _notify_tip(self):
+        # an emptied chain is about to be refilled, there is no tip to announce
+        if not self.tip_listeners or len(self.chain) == 0:
+            return
+        last_block = self.last_block
+        for listener in self.tip_listeners:
+            listener(last_block)
+
+    def _notify_transactions(self, transactions):
+        for listener in self.transaction_listeners:
+            for tr in transactions:
+                listener(tr)
+
+    @property
+    def ledger(self):
+        """
+        Balance index of the chain. It is built from the chain on first use,
+        so a node reopened from its block store does not replay the chain at startup.
+        :return: <Ledger>
+        """
+        if self._ledger is None:
+            with self.lock:
+                if self._ledger is None:
+                    ledger = Ledger()
+                    for block in self.chain:
+                        ledger.apply_block(block)
+                    self._ledger = ledger
+        return self._ledger
+
+    @property
+    def chain_index(self):
+        """
+        Block and transaction lookup tables of the chain, built on first use like the ledger
+        :return: <ChainIndex>
+        """
+        if self._chain_index is None:
+            with self.lock:
+                if self._chain_index is None:
+                    chain_index = ChainIndex()
+                    for block in self.chain:
+                        chain_index.apply_block(block)
+                    self._chain_index = chain_index
+        return self._chain_index
+
+    @serialized
     def new_transaction(self, sender, receiver, amount, private_value=None):
         """
         adds new transaction to go in the next mined block
@@ -137,20 +458,157 @@ class Blockchain(object):
         :param receiver: Address of receiver <str>
         :param amount: amount transferred <int>
         :return: index of the block holding this transaction
+        :raises InsufficientFunds: if the sender's balance does not cover this and its pending transactions
+        :raises MempoolFull: if the pending pool has no room for the transaction
         """
-        new_transaction = Transaction()
-        new_transaction.set_transaction(sender, receiver, amount)
+        self.ledger.check_spend(sender, amount, self.mempool.by_sender(sender))
 
         # sign this transaction
-        if private_value and sender != 'System':
-            sign = new_transaction.sign_transaction(private_value)
-            if sign is None or len(sign) == 0:
-                raise Exception('Transaction could not be signed')
+        new_transaction = Transaction.create(sender, receiver, amount, private_value)
+        if private_value and sender != 'System' and not new_transaction.signature:
+            raise Exception('Transaction could not be signed')
 
-        # add it to current transactions
-        self.currentTransactions.append(new_transaction)
+        # add it to the pending transactions
+        self.mempool.add(new_transaction)
+        self._notify_transactions([new_transaction])
         return self.last_block.index + 1
 
+    @serialized
+    def new_transactions(self, sender, payments, private_value=None):
+        """
+        adds a batch of transactions from one sender, inserted into the pending pool at once
+        :param sender: Address of sender <str>
+        :param payments: <list> of (receiver, amount) tuples
+        :param private_value: private value of the sender's wallet, used to sign the transactions
+        :return: <list> with the pending Transaction of every payment, or the InsufficientFunds,
+                 DuplicateTransaction or MempoolFull error that kept it out of the pool
+        """
+        # funds already committed by the sender's pending transactions and by the batch itself
+        committed = sum(amount_of(tr) for tr in self.mempool.by_sender(sender))
+
+        results = []
+        accepted = []
+        batch_ids = set()
+        for receiver, amount in payments:
+            # the ID doesn't cover the signature, the payment is only signed once it is known to go through
+            unsigned = Transaction(sender, receiver, amount)
+            # the same payment twice within the clock's resolution gets the same ID, it is pending once
+            if unsigned.id in batch_ids or unsigned.id in self.mempool:
+                results.append(DuplicateTransaction(unsigned.id))
+                continue
+            try:
+                self.ledger.check_spend(sender, amount, committed=committed)
+            except InsufficientFunds as exp:
+                results.append(exp)
+                continue
+            committed += amount
+            batch_ids.add(unsigned.id)
+            results.append(Transaction.create(sender, receiver, amount, private_value, unsigned.timestamp))
+            accepted.append(len(results) - 1)
+
+        added = self.mempool.add_many(results[i] for i in accepted)
+        for position, outcome in zip(accepted, added):
+            if outcome is False:
+                results[position] = DuplicateTransaction(results[position].id)
+            elif isinstance(outcome, Exception):
+                results[position] = outcome
+        self._notify_transactions([tr for tr in results if isinstance(tr, Transaction)])
+        return results
+
+    def receive_transactions(self, transactions):
+        """
+        Adds signed transactions relayed by peers to the pending pool.
+        Their signatures are checked in one batch before taking the lock, then the ones
+        already pending or confirmed, or not covered by their sender's balance are dropped.
+        :param transactions: <list> of <Transaction>
+        :return: <tuple> (<list> of the transactions added to the pending pool,
+                 <list> of the ones that can never be added: paid by 'System', moving nothing
+                 or carrying an invalid signature)
+        """
+        invalid = []
+        candidates = []
+        for tr in transactions:
+            if tr.sender == 'System' or amount_of(tr) <= 0:
+                invalid.append(tr)
+            elif tr.id not in self.mempool:
+                candidates.append(tr)
+        valid = self.verifier.verify_transactions(candidates)
+
+        added = []
+        with self.lock:
+            for tr, is_valid in zip(candidates, valid):
+                if not is_valid:
+                    invalid.append(tr)
+                    continue
+                if self.chain_index.transaction_location(tr.id) is not None:
+                    continue
+                try:
+                    self.ledger.check_spend(tr.sender, tr.amount, self.mempool.by_sender(tr.sender))
+                    if self.mempool.add(tr):
+                        added.append(tr)
+                except (InsufficientFunds, MempoolFull):
+                    continue
+        return added, invalid
+
+    def select_transactions(self, max_count, max_bytes):
+        """
+        Highest priority pending transactions that fit in the next block and that their senders
+        can still cover, pending transactions may have lost their funding in a reorg
+        :param max_count: <int> maximum number of transactions
+        :param max_bytes: <int> maximum total size in bytes
+        :return: <list> of <Transaction>
+        """
+        with self.lock:
+            selected = []
+            spent = {}
+            for tr in self.mempool.select(max_count, max_bytes):
+                try:
+                    self.ledger.check_spend(tr.sender, amount_of(tr), committed=spent.get(tr.sender, 0))
+                except InsufficientFunds:
+                    continue
+                spent[tr.sender] = spent.get(tr.sender, 0) + amount_of(tr)
+                selected.append(tr)
+        return selected
+
+    def valid_balances(self, block):
+        """
+        Checks the transactions of a block against the balances of our chain, whose tip
+        must be the block's parent: a single mining reward of at most mining_reward,
+        positive amounts, and no sender spending more than it has
+        :param block: <Block>
+        :return: <bool>
+        """
+        rewards = 0
+        spent = {}
+        for tr in block.transaction:
+            amount = amount_of(tr)
+            if amount <= 0:
+                return False
+            if tr.sender == 'System':
+                rewards += 1
+                if rewards > 1 or amount > self.mining_reward:
+                    return False
+                continue
+            try:
+                self.ledger.check_spend(tr.sender, amount, committed=spent.get(tr.sender, 0))
+            except InsufficientFunds:
+                return False
+            spent[tr.sender] = spent.get(tr.sender, 0) + amount
+        return True
+
+    def _connect(self, blocks):
+        """
+        Appends blocks following our tip, checking each of them against the balances first
+        :param blocks: iterable of Block
+        :return: <Block> the first block that failed the check, None if all of them were appended
+        """
+        for block in blocks:
+            if not self.valid_balances(block):
+                logger.warning('Block %s spends more than its senders have', block.hash)
+                return block
+            self._append_block(block)
+        return None
+
     def proof_of_work(self, last_proof):
         """
         Simple Proof of Work Algorithm:
@@ -159,9 +617,21 @@ class Blockchain(object):
         :param last_proof: <int>
         :return: <int>
         """
-        proof = 0
-        while self.is_valid_proof(last_proof, proof) is False:
-            proof += 1
+        started = perf_counter()
+        if self.miner is not None:
+            proof = self.miner.mine(last_proof, Blockchain.difficulty)
+            hashes = self.miner.last_hashes
+        else:
+            start = 0
+            while True:
+                proof, _ = hashkernel.search(last_proof, start, start + self.pow_batch, Blockchain.difficulty)
+                if proof is not None:
+                    break
+                start += self.pow_batch
+            # the nonces are scanned from 0
+            hashes = proof + 1
+        metrics.POW_SECONDS.observe(perf_counter() - started)
+        metrics.POW_HASHES.observe(hashes)
         return proof
 
     def is_valid_proof(self, last_proof, current_proof):
@@ -175,123 +645,487 @@ class Blockchain(object):
         guess_hash = hashlib.sha256(guess).hexdigest()
         return guess_hash[:Blockchain.difficulty] == '0' * Blockchain.difficulty
 
+    def find_transaction(self, transaction_id):
+        """
+        Looks a confirmed transaction up
+        :param transaction_id: <str>
+        :return: <tuple> (Block, Transaction) or None
+        """
+        with self.lock:
+            location = self.chain_index.transaction_location(transaction_id)
+            if location is None:
+                return None
+            block = self.chain[location[0] - 1]
+        return block, block.transaction[location[1]]
+
+    def find_block(self, block_hash):
+        """
+        Looks a block up by hash, on our chain or on a side branch
+        :param block_hash: <str>
+        :return: <tuple> (Block, <bool> True if it is on our chain) or None
+        """
+        with self.lock:
+            height = self._main_height(block_hash)
+            if height is not None:
+                return self.chain[height - 1], True
+            side = self.tree.get_side(block_hash)
+        return (side[0], False) if side is not None else None
+
+    def address_transactions(self, address, offset=0, limit=None):
+        """
+        Confirmed transactions sent or received by an address, newest first
+        :param address: <str> wallet address
+        :param offset: <int> number of newest transactions to skip
+        :param limit: <int> maximum number of transactions, None for all of them
+        :return: <list> of (Block, Transaction)
+        """
+        with self.lock:
+            found = []
+            for height, position in self.chain_index.locations_of(address, offset, limit):
+                block = self.chain[height - 1]
+                found.append((block, block.transaction[position]))
+        return found
+
     def register_node(self, address):
         """
         Add a new node to the list of nodes
-        :param address: <str> Address of node. Eg. 'http://192.168.0.5:5000'
+        :param address: <str> Address of node. Eg. 'http://192.168.0.5:5000', or its netloc
         :return: None
         """
-        self.nodes.add(urlparse(address).netloc)
+        netloc = PeerClient.netloc(address)
+        if netloc:
+            self.nodes.add(netloc)
+
+    def last_checkpoint(self, chain):
+        """
+        Highest of our checkpoints a candidate chain shares. The block hash commits to
+        the whole history before the block, so the candidate's blocks up to it are the
+        ones we already validated.
+        :param chain: <list> of Block objects or their get_details() dicts
+        :return: <int> position of that block in the candidate chain, or None
+        """
+        for position in range(len(chain) - 1, -1, -1):
+            block = chain[position]
+            index = block.index if isinstance(block, Block) else block['index']
+            if index not in self.checkpoints:
+                continue
+            if not isinstance(block, Block):
+                block = Block.from_details(block)
+            if self.checkpoints[index] == block.hash:
+                return position
+        return None
 
-    def valid_chain(self, chain):
+    @metrics.timed(metrics.VALIDATION_SECONDS)
+    def valid_chain(self, chain, check_signatures=True):
         """
-        Determine if a given blockchain is valid
-        :param chain: <list> A blockchain
+        Determine if a given blockchain is valid.
+        Only the blocks after the last checkpoint the chain shares with ours are checked.
+        :param chain: <list> A blockchain, of Block objects or their get_details() dicts
+        :param check_signatures: <bool> False if the transaction signatures were already verified
         :return: <bool> True if valid, False if not
         """
+        # the blocks before the checkpoint are neither converted nor hashed
+        checkpoint = self.last_checkpoint(chain)
+        if checkpoint is not None:
+            chain = chain[checkpoint:]
+        # blocks received as dicts are converted once so each of them is hashed once
+        chain = [b if isinstance(b, Block) else Block.from_details(b) for b in chain]
+        metrics.VALIDATION_BLOCKS.observe(len(chain) - 1)
         last_block = chain[0]
         current_index = 1
 
         while current_index < len(chain):
             new_block = chain[current_index]
-            print(f'{last_block}')
-            print(f'{new_block}')
-            print("\n-----------\n")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Validating block %s after %s', new_block.get_details(), last_block.get_details())
 
-            # check if block has valid signed transactions
-            #TODO: new_block here is a json string, modify it to be type Block, or make has_valid_transaction take json
-            #string inputs
-            # if not new_block.has_valid_transaction():
-            #    return False
+            # check if the block follows its predecessor
+            if new_block.index != last_block.index + 1:
+                return False
 
             # check if hash of block is correct
-            if new_block['previous_hash'] != self.hash(last_block):
+            if new_block.previous_hash != last_block.hash:
                 return False
 
             # check if proof of work of block is correct
-            if not self.is_valid_proof(last_block['proof'], new_block['proof']):
+            if not self.is_valid_proof(last_block.proof, new_block.proof):
                 return False
 
             last_block = new_block
             current_index += 1
 
+        # check if blocks have valid signed transactions, in one parallel job for the whole chain
+        return not check_signatures or self.valid_signatures(chain[1:])
+
+    def valid_signatures(self, blocks):
+        """
+        :param blocks: <list> of Block
+        :return: <bool> True if every transaction of the blocks is validly signed
+        """
+        return all(all(results) for results in self.verifier.verify_chain(blocks))
+
+    @property
+    def block_work(self):
+        # expected number of hashes to find a proof, the work a single block adds
+        return 16 ** Blockchain.difficulty
+
+    def chain_work(self, height=None):
+        """
+        Cumulative work of our main chain up to a height
+        :param height: <int> defaults to the whole chain
+        :return: <int>
+        """
+        return (len(self.chain) if height is None else height) * self.block_work
+
+    def _main_hash(self, index):
+        # hash of the main chain block with that index, None if there is no such block
+        if 1 <= index <= len(self.chain):
+            if isinstance(self.chain, StoredChain):
+                # read from the store index, the block body is not loaded
+                return self.chain.store.get_hash(index - 1)
+            return self.chain[index - 1].hash
+        return None
+
+    def _main_height(self, block_hash):
+        # index of the main chain block with that hash, None if there is no such block
+        if isinstance(self.chain, StoredChain):
+            # the store keeps its own hash table, built from its index without loading block bodies
+            position = self.chain.store.position_of(block_hash)
+            return None if position is None else position + 1
+        return self.chain_index.block_height(block_hash)
+
+    @serialized
+    def accept_block(self, block, verified=False):
+        """
+        Adds a valid block to the block tree and moves our tip to the branch with the most
+        cumulative work. Switching branches only disconnects our blocks down to the fork
+        point and connects the new branch, so a reorg costs work proportional to its depth.
+        Orphans waiting for the block are accepted after it.
+        :param block: <Block>
+        :param verified: <bool> True if the signatures of the block were already verified
+        :return: <str> 'added' if it extended our tip, 'reorganized' if its branch became our
+                 main chain, 'side' if it was kept on a side branch, 'orphan' if its parent
+                 is unknown, 'known' or 'rejected'
+        """
+        outcome = self._accept_one(block, verified)
+        if outcome in ('added', 'reorganized', 'side'):
+            pending = self.tree.pop_orphans(block.hash)
+            while pending:
+                orphan = pending.pop()
+                if self._accept_one(orphan) in ('added', 'reorganized', 'side'):
+                    pending.extend(self.tree.pop_orphans(orphan.hash))
+            self.tree.prune(len(self.chain) - self.max_reorg_depth)
+        return outcome
+
+    def _accept_one(self, block, verified=False):
+        block_hash = block.hash
+        if self._main_hash(block.index) == block_hash or block_hash in self.tree:
+            return 'known'
+
+        if block.index >= 2 and self._main_hash(block.index - 1) == block.previous_hash:
+            parent, parent_work = self.chain[block.index - 2], self.chain_work(block.index - 1)
+        else:
+            side = self.tree.get_side(block.previous_hash)
+            if side is None:
+                self.tree.add_orphan(block)
+                return 'orphan'
+            parent, parent_work = side
+
+        if not self.valid_chain([parent, block], check_signatures=not verified):
+            return 'rejected'
+
+        if parent.hash == self.last_block.hash:
+            if self._connect([block]) is not None:
+                return 'rejected'
+            return 'added'
+
+        work = parent_work + self.block_work
+        self.tree.add_side(block, work)
+        if work > self.chain_work():
+            if not self._reorganize(block):
+                self.tree.remove_side(block_hash)
+                return 'rejected'
+            return 'reorganized'
+        return 'side'
+
+    def _reorganize(self, tip):
+        """
+        Makes the side branch ending at tip our main chain
+        :param tip: <Block> on a side branch with more work than our main chain
+        :return: <bool> False if the branch no longer connects to our main chain or one of its blocks
+                 overspends, our main chain is left as it was then
+        """
+        # walk the side branch down to the main chain
+        branch = [tip]
+        while self._main_hash(branch[-1].index - 1) != branch[-1].previous_hash:
+            parent = self.tree.get_side(branch[-1].previous_hash)
+            if parent is None:
+                logger.info('Side branch of block %s lost its ancestors, not switching to it', tip.hash)
+                return False
+            branch.append(parent[0])
+        fork = branch[-1].index - 1
+
+        # our blocks after the fork point become a side branch
+        disconnected = self.chain[fork:]
+        for block in disconnected:
+            self.tree.add_side(block, self.chain_work(block.index))
+        self._truncate(fork)
+        invalid = self._connect(reversed(branch))
+        if invalid is not None:
+            # back to our chain, the invalid block and the ones above it are forgotten
+            self._truncate(fork)
+            for block in disconnected:
+                self.tree.remove_side(block.hash)
+                self._append_block(block)
+            for block in branch[:branch.index(invalid) + 1]:
+                self.tree.remove_side(block.hash)
+            return False
+        for block in branch:
+            self.tree.remove_side(block.hash)
+
+        # transactions of the disconnected blocks that the new branch lacks are pending again
+        confirmed = {tr.id for block in branch for tr in block.transaction}
+        for block in disconnected:
+            for tr in block.transaction:
+                if tr.sender != 'System' and tr.id not in confirmed:
+                    try:
+                        self.mempool.add(tr)
+                    except MempoolFull:
+                        pass
         return True
 
-    def register_with_chain(self, remote_chain, private_value=None):
+    def receive_block(self, block, origin=None):
+        """
+        Handles a block pushed by a peer. It goes through the block tree, and a block
+        whose parent we don't know triggers an incremental sync with the sending peer
+        when the peer's chain has more work than ours.
+        :param block: <Block> or its get_details() dict
+        :param origin: <str> netloc of the peer that sent the block, needed to sync
+        :return: <str> as returned by accept_block, or 'synced'
+        """
+        if not isinstance(block, Block):
+            block = Block.from_details(block)
+
+        outcome = self.accept_block(block)
+        if outcome == 'orphan' and origin and block.index * self.block_work > self.chain_work():
+            self.sync_with(origin, block.index)
+            return 'synced'
+        return outcome
+
+    @serialized
+    def register_with_chain(self, remote_chain):
         """
-        Create blockchain with the json remote chain
-        :param private_value:
-        :param remote_chain: chain json string
+        Create blockchain with the remote chain
+        :param remote_chain: <list> of Block or of their get_details() dicts
         :return: None
         """
         # not just genesis block in the remote chain?
         if len(remote_chain) >= 1:
-            for idx, block_data in enumerate(remote_chain):
-                # genesis block is removed from current node
-                if idx == 0:
-                    self.chain.pop(0)
-                for tr in block_data['transactions']:
-                    self.new_transaction(tr['sender'], tr['receiver'], tr['amount'], private_value)
-                added_block = self.new_block(index=block_data['index'], timestamp=block_data['timestamp'],
-                                             proof=block_data['proof'], previous_hash=block_data['previous_hash'])
-                if not added_block:
-                    raise Exception('The chain dump was tampered')
+            blocks = [block if isinstance(block, Block) else Block.from_details(block) for block in remote_chain]
+            if not self.valid_chain(blocks):
+                raise Exception('The remote chain is not valid')
+
+            # the chain is replaced after the last checkpoint it shares with ours,
+            # or as a whole, genesis block included
+            checkpoint = self.last_checkpoint(blocks)
+            if checkpoint is None:
+                self._replace_suffix(0, blocks)
+            else:
+                self._replace_suffix(blocks[checkpoint].index, blocks[checkpoint + 1:])
         else:
             raise Exception('The chain only contains genesis block')
 
-    def resolve_conflicts(self, private_value=None):
+    @serialized
+    def _replace_suffix(self, ancestor, blocks):
+        """
+        Drops our blocks after the common ancestor and appends the new ones.
+        Our blocks are put back if one of the new ones spends more than its senders have.
+        :param ancestor: <int> index of the last block kept, 0 to replace the whole chain
+        :param blocks: <list> of Block following the ancestor
+        :return: None
+        :raises Exception: if a new block overspends
+        """
+        replaced = self.chain[ancestor:]
+        self._truncate(ancestor)
+        invalid = self._connect(blocks)
+        if invalid is not None:
+            self._truncate(ancestor)
+            for block in replaced:
+                self._append_block(block)
+            raise Exception(f'Block {invalid.index} of the new chain spends more than its senders have')
+
+    def block_range(self, start=1, limit=None):
+        """
+        Chain positions of the blocks from the block index start onwards
+        :param start: <int> index of the first block
+        :param limit: <int> maximum number of blocks, None for all of them
+        :return: <range>
+        """
+        position = max(start, 1) - 1
+        stop = len(self.chain) if limit is None else min(len(self.chain), position + max(limit, 0))
+        return range(position, max(stop, position))
+
+    def iter_blocks(self, positions, headers_only=False):
+        """
+        Yields blocks one at a time so a long chain can be served with constant memory.
+        Stops early if the chain got shorter in the meantime, or if a reorganization replaced
+        blocks already yielded, so the blocks yielded always link up.
+        :param positions: <range> as returned by block_range
+        :param headers_only: <bool> yield block headers along with their hash instead of full blocks
+        :return: generator of dicts
+        """
+        previous_hash = None
+        for i in positions:
+            try:
+                block = self.chain[i]
+            except IndexError:
+                return
+            if previous_hash is not None and block.previous_hash != previous_hash:
+                return
+            previous_hash = block.hash
+            if headers_only:
+                header = block.get_header()
+                header['hash'] = block.hash
+                yield header
+            else:
+                yield block.get_details()
+
+    def _fetch_chain(self, node, start, limit, headers_only=False):
+        params = {'from': start, 'limit': limit}
+        if headers_only:
+            params['headers'] = 1
+        resp = self.peers.get(node, '/chain', params=params, headers={'Accept': wire.ACCEPT})
+        if resp.status_code != 200:
+            raise Exception(f'Peer node {node} did not serve its chain: {resp.status_code}')
+        if wire.is_binary(resp.headers.get('Content-Type')):
+            return wire.decode_chain(resp.content, headers_only)['chain']
+        return resp.json()['chain']
+
+    def find_common_ancestor(self, node):
+        """
+        Locates the last block we share with a peer by comparing header hashes
+        from our tip downwards, doubling the window every round.
+        :param node: <str> netloc of the peer
+        :return: <int> index of the common ancestor, 0 if we share no block
+        """
+        height = len(self.chain)
+        window = self.sync_window
+        while height > 0:
+            start = max(1, height - window + 1)
+            headers = self._fetch_chain(node, start, height - start + 1, headers_only=True)
+            for header in reversed(headers):
+                index = header['index']
+                if start <= index <= height and self.chain[index - 1].hash == header['hash']:
+                    return index
+            height = start - 1
+            window *= 2
+        return 0
+
+    def download_blocks(self, node, start, stop):
+        """
+        Downloads the blocks of a peer with index in [start, stop] page by page
+        :param node: <str> netloc of the peer
+        :return: <list> of Block
+        """
+        blocks = []
+        while start <= stop:
+            page = self._fetch_chain(node, start, min(self.sync_page_size, stop - start + 1))
+            if not page:
+                break
+            blocks.extend(Block.from_details(block_data) for block_data in page)
+            start += len(page)
+        return blocks
+
+    def sync_with(self, node, height):
+        """
+        Downloads and applies the blocks of a peer after our common ancestor
+        :param node: <str> netloc of the peer
+        :param height: <int> tip height advertised by the peer
+        :return: None
+        """
+        ancestor = self.find_common_ancestor(node)
+        suffix = self.download_blocks(node, ancestor + 1, height)
+        if not suffix or suffix[0].index != ancestor + 1:
+            raise Exception(f'Peer node {node} did not serve the blocks after {ancestor}')
+
+        if ancestor == 0:
+            # no block in common, not even the genesis block: adopt the peer's chain as a whole,
+            # only if what it served outweighs ours whatever its tip advertised
+            if len(suffix) * self.block_work <= self.chain_work():
+                raise Exception(f'The chain of peer node {node} does not have more work than ours')
+            if not self.valid_chain(suffix):
+                logger.warning('The chain served by peer node %s is not valid', node)
+                raise Exception('The largest of the peers chain is not valid')
+            self._replace_suffix(0, suffix)
+            return
+
+        # the signatures of the whole suffix are verified in one parallel job, without holding
+        # the lock, then the blocks are connected under the lock with the cheap checks only
+        if not self.valid_signatures(suffix):
+            logger.warning('The chain served by peer node %s is not valid', node)
+            raise Exception('The largest of the peers chain is not valid')
+
+        # the suffix extends our copy of the ancestor, the block tree switches to it
+        # once its cumulative work exceeds our chain's
+        with self.lock:
+            for block in suffix:
+                if self.accept_block(block, verified=True) in ('rejected', 'orphan'):
+                    logger.warning('The chain served by peer node %s is not valid', node)
+                    raise Exception('The largest of the peers chain is not valid')
+
+    @metrics.timed(metrics.CONSENSUS_SECONDS)
+    def resolve_conflicts(self):
         """
         This is our Consensus Algorithm, it resolves conflicts
-        by replacing our chain with the longest one in the network.
+        by switching to the chain with the most cumulative work in the network.
+        Peers only advertise their tip, and we only download the blocks
+        after the last block we share with the chosen peer.
+        The tips are requested from all the peers concurrently, unresponsive
+        peers are skipped.
         :return: <bool> True if our chain was replaced, False if not
         """
-        neighbours = self.nodes
-        largest_chain = None
+        best_node = None
         max_len = len(self.chain)
-        length = 0
-        chain = None
+        max_work = self.chain_work()
+        our_tip = self.last_block.hash
 
-        # verify chains from all the nodes in the network
-        for node in neighbours:
-            if node is not None or node != '':
-                resp = requests.get(f'http://{node}/chain')
-            else:
+        # compare the tips of all the nodes in the network
+        for node, resp in self.peers.fan_out(self.nodes, 'GET', '/chain/tip').items():
+            if isinstance(resp, Exception):
+                logger.debug('Peer node %s did not serve its tip: %s', node, resp)
                 continue
-            if resp.status_code == 200:
-                length = resp.json()['length']
-                chain = resp.json()['chain']
-
-            # check if len of neighbour chain is longer than self length and its chain is valid
-            if length >= max_len:
-                largest_chain = chain
-                max_len = length
-
-        # replace our chain if new chain was found
-        if largest_chain:
-            # check if the peer chain is a valid chain before consensus
-            if not self.valid_chain(largest_chain):
-                print('The largest of the peers chain is not valid')
-                raise Exception('The largest of the peers chain is not valid')
+            if resp.status_code != 200:
+                continue
+            tip = resp.json()
+
+            # an equally heavy chain is not worth switching to
+            work = tip.get('work', tip['height'] * self.block_work)
+            if work > max_work and tip['hash'] != our_tip:
+                best_node = node
+                max_len = tip['height']
+                max_work = work
 
-            # Replace our chain with this chain
+        # sync with the peer holding the heaviest chain
+        if best_node:
             try:
-                self.register_with_chain(largest_chain, private_value)
+                self.sync_with(best_node, max_len)
             except Exception as exp:
-                print(exp)
+                logger.warning('Sync with peer node %s failed: %s', best_node, exp)
                 raise Exception(exp)
-            return True
+            return self.last_block.hash != our_tip
 
         return False
 
     @staticmethod
     def hash(block):
         """
-        Creates a SHA-256 hash of a Block
-        :param block: <Block> Block
+        Creates a SHA-256 hash of a Block, Block objects cache their hash
+        :param block: <Block> Block or its get_details() dict
         :return: <str>
         """
-        block_string = json.dumps(block.get_details(), sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+        if not isinstance(block, Block):
+            block = Block.from_details(block)
+        return block.hash
 
     @property
     def last_block(self):
@@ -0,0 +1,270 @@
+from collections import OrderedDict
+from collections.abc import Sequence
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+# segment record header: magic, payload length, crc32 of the payload
+RECORD_HEADER = struct.Struct('>4sII')
+RECORD_MAGIC = b'BLK1'
+
+# index entry per block height: offset of its record in the segment, raw block hash
+INDEX_ENTRY = struct.Struct('>Q32s')
+
+
+class BlockStore(object):
+    """
+    Append-only on-disk block store.
+    Blocks are written as checksummed records to a segment file, and a fixed width
+    index file maps every chain position to the record offset and the block hash.
+    Both files are read through mmap so opening the store only looks at its tail.
+    """
+    segment_name = 'blocks.dat'
+    index_name = 'blocks.idx'
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._segment = open(os.path.join(path, self.segment_name), 'a+b')
+        self._index = open(os.path.join(path, self.index_name), 'a+b')
+        self._segment_map = None
+        self._index_map = None
+        self._by_hash = None
+        self._recover()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._unmap()
+            self._segment.close()
+            self._index.close()
+
+    def _unmap(self):
+        for m in (self._segment_map, self._index_map):
+            if m is not None:
+                m.close()
+        self._segment_map = None
+        self._index_map = None
+
+    @staticmethod
+    def _map(f, size):
+        return mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+
+    def _remap(self):
+        self._unmap()
+        self._segment_map = self._map(self._segment, self._segment_size)
+        self._index_map = self._map(self._index, self._count * INDEX_ENTRY.size)
+
+    def _read_record(self, data, offset, size):
+        """
+        Reads the record at offset of a segment buffer
+        :return: <bytes> payload, or None if the record is torn or corrupt
+        """
+        if offset + RECORD_HEADER.size > size:
+            return None
+        magic, length, crc = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        if magic != RECORD_MAGIC or start + length > size:
+            return None
+        payload = data[start:start + length]
+        if zlib.crc32(payload) != crc:
+            return None
+        return payload
+
+    def _recover(self):
+        """
+        Drops index entries pointing to torn records, re-indexes complete records
+        written after the last index entry, and truncates a torn final record
+        """
+        segment_size = os.fstat(self._segment.fileno()).st_size
+        index_size = os.fstat(self._index.fileno()).st_size
+        count = index_size // INDEX_ENTRY.size
+
+        segment = self._map(self._segment, segment_size)
+        index = self._map(self._index, count * INDEX_ENTRY.size)
+        try:
+            end = 0
+            while count:
+                offset, _ = INDEX_ENTRY.unpack_from(index, (count - 1) * INDEX_ENTRY.size)
+                payload = self._read_record(segment, offset, segment_size) if segment else None
+                if payload is not None:
+                    end = offset + RECORD_HEADER.size + len(payload)
+                    break
+                count -= 1
+
+            recovered = []
+            while segment is not None:
+                payload = self._read_record(segment, end, segment_size)
+                if payload is None:
+                    break
+                block = json.loads(payload)
+                recovered.append(INDEX_ENTRY.pack(end, bytes.fromhex(block['hash'])))
+                end += RECORD_HEADER.size + len(payload)
+        finally:
+            for m in (segment, index):
+                if m is not None:
+                    m.close()
+
+        if end != segment_size:
+            self._segment.truncate(end)
+            self._fsync(self._segment)
+        if count * INDEX_ENTRY.size != index_size or recovered:
+            self._index.truncate(count * INDEX_ENTRY.size)
+            self._index.seek(0, os.SEEK_END)
+            self._index.write(b''.join(recovered))
+            self._fsync(self._index)
+            count += len(recovered)
+
+        self._segment_size = end
+        self._count = count
+        self._remap()
+
+    @staticmethod
+    def _fsync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    def append(self, details, block_hash):
+        """
+        Durably appends a block, the record is synced before its index entry is written
+        :param details: <dict> get_details() of the block
+        :param block_hash: <str> hash of the block
+        :return: <int> position of the block in the chain
+        """
+        record = dict(details, hash=block_hash)
+        payload = json.dumps(record, sort_keys=True).encode()
+        with self._lock:
+            offset = self._segment_size
+            self._segment.seek(0, os.SEEK_END)
+            self._segment.write(RECORD_HEADER.pack(RECORD_MAGIC, len(payload), zlib.crc32(payload)))
+            self._segment.write(payload)
+            self._fsync(self._segment)
+
+            self._index.seek(0, os.SEEK_END)
+            self._index.write(INDEX_ENTRY.pack(offset, bytes.fromhex(block_hash)))
+            self._fsync(self._index)
+
+            self._segment_size = offset + RECORD_HEADER.size + len(payload)
+            position = self._count
+            self._count += 1
+            if self._by_hash is not None:
+                self._by_hash[block_hash] = position
+            self._remap()
+            return position
+
+    def truncate(self, length):
+        """
+        Drops every block from position length onwards, used when the chain is replaced.
+        The segment is cut before the index, a crash in between leaves index entries
+        without records which are dropped on the next start.
+        :param length: <int> number of blocks to keep
+        """
+        with self._lock:
+            if length >= self._count:
+                return
+            offset, _ = INDEX_ENTRY.unpack_from(self._index_map, length * INDEX_ENTRY.size)
+            self._unmap()
+            self._segment.truncate(offset)
+            self._fsync(self._segment)
+            self._index.truncate(length * INDEX_ENTRY.size)
+            self._fsync(self._index)
+            self._segment_size = offset
+            self._count = length
+            self._by_hash = None
+            self._remap()
+
+    def get_hash(self, position):
+        """
+        :param position: <int> position of the block in the chain
+        :return: <str> hash of the block, read from the index only
+        """
+        with self._lock:
+            _, raw_hash = INDEX_ENTRY.unpack_from(self._index_map, position * INDEX_ENTRY.size)
+            return raw_hash.hex()
+
+    def get(self, position):
+        """
+        Reads a block body from the segment
+        :param position: <int> position of the block in the chain
+        :return: <dict> get_details() of the block
+        """
+        with self._lock:
+            if not 0 <= position < self._count:
+                raise IndexError('block position out of range')
+            offset, _ = INDEX_ENTRY.unpack_from(self._index_map, position * INDEX_ENTRY.size)
+            payload = self._read_record(self._segment_map, offset, self._segment_size)
+        if payload is None:
+            raise Exception(f'The block store record at position {position} is corrupt')
+        details = json.loads(payload)
+        details.pop('hash')
+        return details
+
+    def position_of(self, block_hash):
+        """
+        :param block_hash: <str>
+        :return: <int> position of the block with that hash, or None.
+        The hash lookup table is built from the index on first use.
+        """
+        with self._lock:
+            if self._by_hash is None:
+                data = self._index_map or b''
+                self._by_hash = {
+                    data[i + 8:i + INDEX_ENTRY.size].hex(): i // INDEX_ENTRY.size
+                    for i in range(0, self._count * INDEX_ENTRY.size, INDEX_ENTRY.size)
+                }
+            return self._by_hash.get(block_hash)
+
+
+class StoredChain(Sequence):
+    """
+    List-like view of the chain kept in a BlockStore.
+    Block bodies are loaded on access and a few recently used ones are cached.
+    """
+    cache_size = 256
+
+    def __init__(self, store, loader):
+        """
+        :param store: <BlockStore>
+        :param loader: callable building a Block from its get_details() dict
+        """
+        self.store = store
+        self._loader = loader
+        self._cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError('chain index out of range')
+        block = self._cache.get(item)
+        if block is None:
+            block = self._loader(self.store.get(item))
+            self._cache[item] = block
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(item)
+        return block
+
+    def append(self, block):
+        position = self.store.append(block.get_details(), block.hash)
+        self._cache[position] = block
+
+    def __delitem__(self, item):
+        if not isinstance(item, slice) or item.stop is not None or item.step is not None:
+            raise TypeError('only the tail of a stored chain can be deleted')
+        start = item.indices(len(self))[0]
+        self.store.truncate(start)
+        for position in [p for p in self._cache if p >= start]:
+            del self._cache[position]
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+
+
+class BlockTree(object):
+    """
+    Valid blocks that are not on our main chain, indexed by hash.
+    Side branch blocks are kept along with their cumulative work so we can switch
+    to their branch once it outweighs the main chain. Orphans, whose parent we
+    don't know yet, wait indexed by the hash of that parent.
+    The main chain itself stays in Blockchain.chain.
+    """
+    # cap of the orphan pool, the oldest orphans are dropped first
+    max_orphans = 100
+
+    def __init__(self):
+        # hash -> (Block, cumulative work)
+        self.side = {}
+        # hash -> Block, in arrival order
+        self.orphans = OrderedDict()
+        # parent hash -> {hash: None}
+        self._orphans_by_parent = {}
+
+    def __contains__(self, block_hash):
+        return block_hash in self.side or block_hash in self.orphans
+
+    def add_side(self, block, work):
+        self.side[block.hash] = (block, work)
+
+    def get_side(self, block_hash):
+        """
+        :param block_hash: <str>
+        :return: <tuple> (Block, cumulative work), or None if the block is not on a side branch
+        """
+        return self.side.get(block_hash)
+
+    def remove_side(self, block_hash):
+        self.side.pop(block_hash, None)
+
+    def add_orphan(self, block):
+        if block.hash in self.orphans:
+            return
+        self.orphans[block.hash] = block
+        self._orphans_by_parent.setdefault(block.previous_hash, {})[block.hash] = None
+        while len(self.orphans) > self.max_orphans:
+            self._drop_orphan(next(iter(self.orphans)))
+
+    def _drop_orphan(self, block_hash):
+        block = self.orphans.pop(block_hash)
+        siblings = self._orphans_by_parent[block.previous_hash]
+        del siblings[block_hash]
+        if not siblings:
+            del self._orphans_by_parent[block.previous_hash]
+        return block
+
+    def pop_orphans(self, parent_hash):
+        """
+        Removes and returns the orphans waiting for a block
+        :param parent_hash: <str> hash of the block that just got connected
+        :return: <list> of Block
+        """
+        return [self._drop_orphan(h) for h in list(self._orphans_by_parent.get(parent_hash, ()))]
+
+    def prune(self, min_index):
+        """
+        Forgets the side branches forking too deep below our tip to ever be reorganized to.
+        Branches go as a whole, so no kept block is left without its ancestors.
+        :param min_index: <int> lowest fork point kept
+        """
+        forks = {}
+        for block_hash in self.side:
+            # blocks of the same branch share their fork point, walk each branch once
+            path = []
+            block = self.side[block_hash][0]
+            while block.hash not in forks and block.previous_hash in self.side:
+                path.append(block.hash)
+                block = self.side[block.previous_hash][0]
+            fork = forks.get(block.hash, block.index - 1)
+            forks[block.hash] = fork
+            for h in path:
+                forks[h] = fork
+        for block_hash in [h for h, fork in forks.items() if fork < min_index]:
+            del self.side[block_hash]
@@ -0,0 +1,76 @@
+class ChainIndex(object):
+    """
+    Lookup tables of the main chain: blocks by hash, and transactions by ID and
+    by address. Like the ledger, blocks are applied in chain order and reverted in
+    the opposite order, so unwinding a block only pops the tail of the address lists.
+    Block heights need no table, height n is position n - 1 of the chain.
+    """
+
+    def __init__(self):
+        # block hash -> block index
+        self.blocks = {}
+        # transaction id -> (block index, position in the block)
+        self.transactions = {}
+        # address -> list of (block index, position in the block), oldest first
+        self.addresses = {}
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def block_height(self, block_hash):
+        """
+        :param block_hash: <str>
+        :return: <int> index of the main chain block with that hash, or None
+        """
+        return self.blocks.get(block_hash)
+
+    def transaction_location(self, transaction_id):
+        """
+        :param transaction_id: <str>
+        :return: <tuple> (block index, position in the block), or None if it is not confirmed
+        """
+        return self.transactions.get(transaction_id)
+
+    def count_of(self, address):
+        return len(self.addresses.get(address, ()))
+
+    def locations_of(self, address, offset=0, limit=None):
+        """
+        :param address: <str> wallet address, as sender or receiver
+        :param offset: <int> number of newest transactions to skip
+        :param limit: <int> maximum number of transactions, None for all of them
+        :return: <list> of (block index, position in the block), newest first
+        """
+        entries = self.addresses.get(address, [])
+        stop = len(entries) - offset
+        start = 0 if limit is None else max(stop - limit, 0)
+        return list(reversed(entries[start:max(stop, 0)]))
+
+    def apply_block(self, block):
+        """
+        :param block: <Block> appended to the chain
+        """
+        self.blocks[block.hash] = block.index
+        for position, tr in enumerate(block.transaction):
+            location = (block.index, position)
+            self.transactions[tr.id] = location
+            self.addresses.setdefault(tr.sender, []).append(location)
+            if tr.receiver != tr.sender:
+                self.addresses.setdefault(tr.receiver, []).append(location)
+
+    def _unlist(self, address):
+        entries = self.addresses[address]
+        entries.pop()
+        if not entries:
+            del self.addresses[address]
+
+    def revert_block(self, block):
+        """
+        :param block: <Block> removed from the tip of the chain
+        """
+        for tr in reversed(block.transaction):
+            if tr.receiver != tr.sender:
+                self._unlist(tr.receiver)
+            self._unlist(tr.sender)
+            self.transactions.pop(tr.id, None)
+        del self.blocks[block.hash]
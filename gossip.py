@@ -0,0 +1,283 @@
+from collections import OrderedDict
+from time import monotonic
+import json
+import logging
+import random
+import threading
+import metrics
+from blockchain import Block, ComplexEncoder, Transaction
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION = 'tx'
+BLOCK = 'block'
+
+
+class SeenCache(object):
+    """
+    Set of recently seen keys, each one forgotten ttl seconds after it was added.
+    Keys are kept in insertion order, which is also their expiry order,
+    so expiring them only pops the front. Past max_size the oldest keys go first.
+    """
+    # seconds a key is remembered
+    ttl = 600.0
+
+    # most keys remembered at once
+    max_size = 100000
+
+    def __init__(self, ttl=None, max_size=None):
+        self.ttl = ttl or self.ttl
+        self.max_size = max_size or self.max_size
+        self._expiry = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def __contains__(self, key):
+        with self._lock:
+            self._expire(monotonic())
+            return key in self._expiry
+
+    def _expire(self, now):
+        while self._expiry:
+            key, expiry = next(iter(self._expiry.items()))
+            if expiry > now and len(self._expiry) <= self.max_size:
+                break
+            self._expiry.popitem(last=False)
+
+    def add(self, key):
+        """
+        :param key: hashable
+        :return: <bool> True if the key was not seen within the ttl
+        """
+        with self._lock:
+            now = monotonic()
+            self._expire(now)
+            if key in self._expiry:
+                return False
+            self._expiry[key] = now + self.ttl
+            return True
+
+    def discard(self, key):
+        with self._lock:
+            self._expiry.pop(key, None)
+
+
+class GossipRelay(object):
+    """
+    Spreads new transactions and blocks through the network by gossip.
+    New items are queued and flushed in batches: every flush announces the batch
+    IDs to `fanout` random peers in one inventory message, and each peer answers
+    with the IDs it is missing, which are then sent to it in one data message.
+    Peers relay what they accepted the same way, so every node sends an item to
+    at most `fanout` peers and a message costs traffic linear in the number of nodes.
+    A seen cache keeps a node from processing or relaying an item twice.
+    """
+    # peers every batch is announced to
+    fanout = 6
+
+    # seconds between two flushes of the queued items
+    flush_interval = 0.05
+
+    # most items announced in a single inventory message
+    max_batch = 500
+
+    # seconds an item we asked a peer for is not asked from other peers
+    request_ttl = 5.0
+
+    def __init__(self, blockchain, origin=None, fanout=None):
+        """
+        :param blockchain: <Blockchain> the items are taken from and added to
+        :param origin: callable returning the address peers reach us at, sent along so they can sync from us
+        :param fanout: <int> peers every batch is announced to
+        """
+        self.blockchain = blockchain
+        self.origin = origin
+        self.fanout = fanout or self.fanout
+        self.seen = SeenCache()
+        self.requested = SeenCache(ttl=self.request_ttl)
+        # (kind, id, netloc of the peer we got it from or None)
+        self._queue = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def _headers(self):
+        origin = self.origin() if self.origin else None
+        return {'X-Node-Address': origin} if origin else {}
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='gossip-relay', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as exp:
+                logger.warning(f'Gossip flush failed: {exp}')
+
+    def relay(self, kind, item_id, source=None):
+        """
+        Queues an item for the next flush, unless it was already seen
+        :param kind: TRANSACTION or BLOCK
+        :param item_id: <str> transaction ID or block hash
+        :param source: <str> netloc of the peer that sent us the item, it is not announced back to it
+        :return: <bool> True if the item was queued
+        """
+        if not self.seen.add((kind, item_id)):
+            return False
+        self._enqueue(kind, item_id, source)
+        return True
+
+    def _enqueue(self, kind, item_id, source):
+        with self._lock:
+            self._queue.append((kind, item_id, source))
+            if len(self._queue) >= self.max_batch:
+                self._wakeup.set()
+        self._start()
+
+    def flush(self):
+        """
+        Announces the queued items to random peers and sends them the ones they are missing
+        :return: <dict> netloc -> number of items sent, or the exception raised for that peer
+        """
+        with self._lock:
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+        if not batch:
+            return {}
+
+        peers = self.blockchain.peers
+        calls = {}
+        candidates = [p for p in self.blockchain.nodes if peers.is_available(p)]
+        for peer in random.sample(candidates, len(candidates)):
+            if len(calls) == self.fanout:
+                break
+            inventory = [[kind, item_id] for kind, item_id, source in batch if source != peer]
+            if inventory:
+                calls[peer] = lambda peer=peer, inventory=inventory: self._exchange(peer, inventory)
+
+        results = peers.gather(calls)
+        for peer, result in results.items():
+            if isinstance(result, Exception):
+                logger.info(f'Gossip with peer node {peer} failed: {result}')
+        return results
+
+    def _exchange(self, peer, inventory):
+        peers = self.blockchain.peers
+        metrics.GOSSIP_MESSAGES.inc(message='inv')
+        response = peers.post(peer, '/gossip/inv', json={'inventory': inventory}, headers=self._headers())
+        if response.status_code != 200:
+            raise Exception(f'{response.status_code} {response.text}')
+        wanted = response.json().get('want', [])
+
+        data = {'transactions': [], 'blocks': []}
+        for kind, item_id in wanted:
+            if kind == TRANSACTION:
+                tr = self._find_transaction(item_id)
+                if tr is not None:
+                    data['transactions'].append(tr.get_details())
+            elif kind == BLOCK:
+                found = self.blockchain.find_block(item_id)
+                if found is not None:
+                    data['blocks'].append(found[0].get_details())
+        sent = len(data['transactions']) + len(data['blocks'])
+        if sent == 0:
+            return 0
+
+        metrics.GOSSIP_MESSAGES.inc(message='data')
+        metrics.GOSSIP_ITEMS.inc(sent)
+        headers = dict(self._headers(), **{'Content-Type': 'application/json'})
+        response = peers.post(peer, '/gossip/data', data=json.dumps(data, cls=ComplexEncoder), headers=headers)
+        if response.status_code != 200:
+            raise Exception(f'{response.status_code} {response.text}')
+        return sent
+
+    def _find_transaction(self, transaction_id):
+        tr = self.blockchain.mempool.get(transaction_id)
+        if tr is None:
+            found = self.blockchain.find_transaction(transaction_id)
+            tr = found[1] if found is not None else None
+        return tr
+
+    def _is_known(self, kind, item_id):
+        if kind == TRANSACTION:
+            return self._find_transaction(item_id) is not None
+        return item_id in self.blockchain.tree or self.blockchain.find_block(item_id) is not None
+
+    def wanted(self, inventory):
+        """
+        Picks the announced items we are missing and haven't asked another peer for yet
+        :param inventory: <list> of [kind, id] pairs
+        :return: <list> of the [kind, id] pairs to ask for
+        """
+        wanted = []
+        for kind, item_id in inventory:
+            if kind not in (TRANSACTION, BLOCK) or (kind, item_id) in self.seen:
+                continue
+            if self._is_known(kind, item_id) or not self.requested.add((kind, item_id)):
+                continue
+            wanted.append([kind, item_id])
+        return wanted
+
+    def receive(self, transactions, blocks, source=None):
+        """
+        Adds the transactions and blocks a peer sent us and relays the ones we accepted
+        :param transactions: <list> of transaction dicts
+        :param blocks: <list> of block dicts
+        :param source: <str> netloc of the sending peer, blocks we can't connect make us sync from it
+        :return: <dict> with the number of transactions and blocks accepted
+        """
+        # blocks first, transactions of the same message may spend what they pay
+        accepted_blocks = 0
+        parsed = []
+        for details in blocks:
+            try:
+                parsed.append(Block.from_details(details))
+            except (KeyError, TypeError, ValueError):
+                continue
+        for block in sorted(parsed, key=lambda b: b.index):
+            self.requested.discard((BLOCK, block.hash))
+            if (BLOCK, block.hash) in self.seen:
+                continue
+            try:
+                outcome = self.blockchain.receive_block(block, source)
+            except Exception as exp:
+                logger.info(f'Error occurred while syncing with peer node {source}: {exp}')
+                continue
+            self.seen.add((BLOCK, block.hash))
+            if outcome in ('added', 'reorganized', 'synced', 'side'):
+                accepted_blocks += 1
+                self._enqueue(BLOCK, block.hash, source)
+
+        received = []
+        for details in transactions:
+            try:
+                tr = Transaction.from_details(details)
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.requested.discard((TRANSACTION, tr.id))
+            if (TRANSACTION, tr.id) not in self.seen:
+                received.append(tr)
+        added, invalid = self.blockchain.receive_transactions(received)
+        # transactions rejected for the balance of their sender may be valid once we get more blocks,
+        # they are not marked as seen so another peer can send them again
+        for tr in invalid:
+            self.seen.add((TRANSACTION, tr.id))
+        for tr in added:
+            if self.seen.add((TRANSACTION, tr.id)):
+                self._enqueue(TRANSACTION, tr.id, source)
+
+        return {'transactions': len(added), 'blocks': accepted_blocks}
+
+    def get_details(self):
+        return {
+            'fanout': self.fanout,
+            'queued': len(self._queue),
+            'seen': len(self.seen)
+        }
@@ -0,0 +1,83 @@
+import hashlib
+
+# nonces are hashed in batches sharing all but their last digits
+BATCH_DIGITS = 3
+BATCH_SIZE = 10 ** BATCH_DIGITS
+_SUFFIXES = tuple(b'%0*d' % (BATCH_DIGITS, i) for i in range(BATCH_SIZE))
+
+
+def target_for(difficulty):
+    """
+    Numeric target for a difficulty: a digest has <difficulty> leading hex zeroes
+    exactly when it is below 2 ** (256 - 4 * difficulty)
+    :param difficulty: <int> number of leading hex zeroes required, at least 1
+    :return: <bytes> 32 byte big endian target, compare raw digests against it
+    """
+    return (1 << (256 - 4 * difficulty)).to_bytes(32, 'big')
+
+
+def is_valid_proof(last_proof, current_proof, difficulty):
+    """
+    Same check as Blockchain.is_valid_proof on the raw digest
+    :return: <bool>
+    """
+    if difficulty <= 0:
+        return True
+    digest = hashlib.sha256(f'{last_proof}{current_proof}'.encode()).digest()
+    return digest < target_for(difficulty)
+
+
+def search(last_proof, start, stop, difficulty):
+    """
+    Scans the nonces in [start, stop) in increasing order for the first valid proof.
+    The last_proof prefix is hashed once and its state cloned for every candidate,
+    nonces sharing their leading digits reuse a second midstate and only
+    hash their last BATCH_DIGITS digits.
+    :param last_proof: <int> Previous proof
+    :param start: <int> first nonce to try
+    :param stop: <int> nonce to stop at (exclusive)
+    :param difficulty: <int> number of leading hex zeroes required
+    :return: <tuple> (proof or None, number of hashes computed)
+    """
+    if start >= stop:
+        return None, 0
+    if difficulty <= 0:
+        return start, 1
+
+    target = target_for(difficulty)
+    prefix = hashlib.sha256(str(last_proof).encode())
+
+    def scan(lo, hi):
+        copy = prefix.copy
+        for nonce in range(lo, hi):
+            h = copy()
+            h.update(b'%d' % nonce)
+            if h.digest() < target:
+                return nonce
+        return None
+
+    # unaligned head, and the nonces below BATCH_SIZE which have no zero padding
+    head_stop = min(stop, max(BATCH_SIZE, -(-start // BATCH_SIZE) * BATCH_SIZE))
+    proof = scan(start, head_stop)
+    if proof is not None:
+        return proof, proof - start + 1
+
+    base = head_stop // BATCH_SIZE
+    last_base = stop // BATCH_SIZE
+    while base < last_base:
+        mid = prefix.copy()
+        mid.update(b'%d' % base)
+        copy = mid.copy
+        for suffix in _SUFFIXES:
+            h = copy()
+            h.update(suffix)
+            if h.digest() < target:
+                proof = base * BATCH_SIZE + int(suffix)
+                return proof, proof - start + 1
+        base += 1
+
+    tail_start = max(head_stop, last_base * BATCH_SIZE)
+    proof = scan(tail_start, stop)
+    if proof is not None:
+        return proof, proof - start + 1
+    return None, stop - start
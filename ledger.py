@@ -0,0 +1,93 @@
+from numbers import Number
+
+
+class InsufficientFunds(Exception):
+    pass
+
+
+def amount_of(transaction):
+    """
+    Amount moved by a transaction, non numeric amounts move nothing
+    :param transaction: <Transaction>
+    :return: <int> or <float>
+    """
+    amount = transaction.amount
+    if isinstance(amount, bool) or not isinstance(amount, Number):
+        return 0
+    return amount
+
+
+class Ledger(object):
+    """
+    Account balances and per address history, maintained block by block.
+    Blocks are applied in chain order and reverted in the opposite order,
+    so reverting a block only pops the tail of the histories it touched.
+    """
+
+    def __init__(self):
+        self.balances = {}
+        # address -> list of (block index, transaction id, balance change)
+        self.history = {}
+
+    def balance(self, address):
+        return self.balances.get(address, 0)
+
+    def get_history(self, address, offset=0, limit=None):
+        """
+        :param address: <str> wallet address
+        :param offset: <int> number of newest entries to skip
+        :param limit: <int> maximum number of entries, None for all of them
+        :return: <list> of dicts, newest first
+        """
+        entries = self.history.get(address, [])
+        stop = len(entries) - offset
+        start = 0 if limit is None else max(stop - limit, 0)
+        return [{'block': block_index, 'transaction': transaction_id, 'amount': change}
+                for block_index, transaction_id, change in reversed(entries[start:max(stop, 0)])]
+
+    def _credit(self, address, block_index, transaction_id, change):
+        self.balances[address] = self.balances.get(address, 0) + change
+        self.history.setdefault(address, []).append((block_index, transaction_id, change))
+
+    def _uncredit(self, address, change):
+        self.balances[address] -= change
+        entries = self.history[address]
+        entries.pop()
+        if not entries:
+            del self.history[address]
+            del self.balances[address]
+
+    def apply_block(self, block):
+        """
+        :param block: <Block> appended to the chain
+        """
+        for tr in block.transaction:
+            amount = amount_of(tr)
+            if tr.sender != 'System':
+                self._credit(tr.sender, block.index, tr.id, -amount)
+            self._credit(tr.receiver, block.index, tr.id, amount)
+
+    def revert_block(self, block):
+        """
+        :param block: <Block> removed from the tip of the chain
+        """
+        for tr in reversed(block.transaction):
+            amount = amount_of(tr)
+            self._uncredit(tr.receiver, amount)
+            if tr.sender != 'System':
+                self._uncredit(tr.sender, -amount)
+
+    def check_spend(self, sender, amount, pending=(), committed=0):
+        """
+        Rejects a payment the sender cannot cover
+        :param sender: <str> wallet address
+        :param amount: amount of the new transaction
+        :param pending: pending transactions of the sender, their amounts are already committed
+        :param committed: amount already committed besides the pending transactions
+        :raises InsufficientFunds:
+        """
+        if sender == 'System':
+            return
+        available = self.balance(sender) - sum(amount_of(tr) for tr in pending) - committed
+        if amount > available:
+            raise InsufficientFunds(f'Insufficient funds: {available} available, {amount} requested')
@@ -0,0 +1,189 @@
+from bisect import bisect_left, insort
+from itertools import count
+import json
+import threading
+
+
+class MempoolFull(Exception):
+    pass
+
+
+class DuplicateTransaction(Exception):
+    def __init__(self, transaction_id):
+        super().__init__(f'Transaction {transaction_id} is already pending')
+        self.transaction_id = transaction_id
+
+
+def default_priority(transaction):
+    """
+    Mining rewards first, then the other transactions in arrival order
+    (arrival order is applied by the mempool itself)
+    :param transaction: <Transaction>
+    :return: sort key, lower keys are mined first
+    """
+    return 0 if transaction.sender == 'System' else 1
+
+
+class Mempool(object):
+    """
+    Pool of pending transactions.
+    Transactions are indexed by ID and by sender and kept in priority order.
+    The pool is capped by transaction count and by encoded size, when it is full the
+    lowest priority transaction is evicted if the incoming one ranks higher,
+    otherwise the incoming one is rejected.
+    """
+    # default caps of the pool
+    max_count = 10000
+    max_bytes = 8 * 1024 * 1024
+
+    def __init__(self, max_count=None, max_bytes=None, priority=None):
+        """
+        :param max_count: <int> maximum number of pending transactions
+        :param max_bytes: <int> maximum total size of the pending transactions, in bytes of JSON
+        :param priority: callable Transaction -> sort key, lower keys are mined first
+        """
+        self.max_count = max_count or self.max_count
+        self.max_bytes = max_bytes or self.max_bytes
+        self.priority = priority or default_priority
+        self._lock = threading.RLock()
+        self._seq = count()
+        # id -> (transaction, size, order key)
+        self._transactions = {}
+        # sender -> {id: None} in arrival order
+        self._by_sender = {}
+        # sorted (priority, arrival, id)
+        self._order = []
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._transactions)
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self._transactions
+
+    def __iter__(self):
+        return iter(self.page())
+
+    @property
+    def size(self):
+        # total encoded size of the pending transactions, in bytes
+        return self._bytes
+
+    @staticmethod
+    def _encoded_size(transaction):
+        return len(json.dumps(transaction.get_details()))
+
+    def get(self, transaction_id):
+        entry = self._transactions.get(transaction_id)
+        return entry[0] if entry else None
+
+    def by_sender(self, sender):
+        """
+        :param sender: <str> wallet address
+        :return: <list> pending transactions of the sender in arrival order
+        """
+        with self._lock:
+            return [self._transactions[i][0] for i in self._by_sender.get(sender, ())]
+
+    def add(self, transaction):
+        """
+        Adds a transaction unless it is already pending
+        :param transaction: <Transaction>
+        :return: <bool> True if added, False if it was a duplicate
+        :raises MempoolFull: if the pool is full of transactions ranking at least as high
+        """
+        transaction_id = transaction.id
+        size = self._encoded_size(transaction)
+        with self._lock:
+            if transaction_id in self._transactions:
+                return False
+            if size > self.max_bytes:
+                raise MempoolFull('The transaction is larger than the pending transaction pool')
+            key = (self.priority(transaction), next(self._seq), transaction_id)
+
+            # lowest ranking transactions to evict to make room, the pool is only
+            # changed once the new transaction is known to outrank all of them
+            evicted = 0
+            freed = 0
+            while len(self._transactions) - evicted >= self.max_count or self._bytes - freed + size > self.max_bytes:
+                victim = self._order[-1 - evicted]
+                if victim < key:
+                    raise MempoolFull('The pending transaction pool is full')
+                freed += self._transactions[victim[2]][1]
+                evicted += 1
+            for victim in self._order[len(self._order) - evicted:]:
+                self.remove(victim[2])
+
+            self._transactions[transaction_id] = (transaction, size, key)
+            self._by_sender.setdefault(transaction.sender, {})[transaction_id] = None
+            insort(self._order, key)
+            self._bytes += size
+            return True
+
+    def add_many(self, transactions):
+        """
+        Adds a batch of transactions under a single lock
+        :param transactions: iterable of <Transaction>
+        :return: <list> of <bool> as returned by add, or the MempoolFull error for that transaction
+        """
+        results = []
+        with self._lock:
+            for transaction in transactions:
+                try:
+                    results.append(self.add(transaction))
+                except MempoolFull as exp:
+                    results.append(exp)
+        return results
+
+    def remove(self, transaction_id):
+        """
+        :param transaction_id: <str>
+        :return: <Transaction> the removed transaction, or None if it was not pending
+        """
+        with self._lock:
+            entry = self._transactions.pop(transaction_id, None)
+            if entry is None:
+                return None
+            transaction, size, key = entry
+            senders = self._by_sender[transaction.sender]
+            del senders[transaction_id]
+            if not senders:
+                del self._by_sender[transaction.sender]
+            del self._order[bisect_left(self._order, key)]
+            self._bytes -= size
+            return transaction
+
+    def remove_many(self, transaction_ids):
+        with self._lock:
+            for transaction_id in transaction_ids:
+                self.remove(transaction_id)
+
+    def select(self, max_count, max_bytes):
+        """
+        Highest priority transactions that fit in a block, the pool is left untouched
+        :param max_count: <int> maximum number of transactions
+        :param max_bytes: <int> maximum total size in bytes
+        :return: <list> of <Transaction>
+        """
+        selected = []
+        total = 0
+        with self._lock:
+            for _, _, transaction_id in self._order:
+                if len(selected) >= max_count:
+                    break
+                transaction, size, _ = self._transactions[transaction_id]
+                if total + size > max_bytes:
+                    continue
+                selected.append(transaction)
+                total += size
+        return selected
+
+    def page(self, offset=0, limit=None):
+        """
+        :param offset: <int> position in priority order of the first transaction
+        :param limit: <int> maximum number of transactions, None for all of them
+        :return: <list> of <Transaction> in priority order
+        """
+        with self._lock:
+            stop = None if limit is None else offset + limit
+            return [self._transactions[i][0] for _, _, i in self._order[offset:stop]]
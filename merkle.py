@@ -0,0 +1,81 @@
+import hashlib
+
+# leaves and inner nodes are hashed with different prefixes so a leaf can't pass for a subtree
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def leaf_hash(data):
+    """
+    :param data: <bytes> canonical encoding of a transaction
+    :return: <bytes>
+    """
+    return hashlib.sha256(LEAF_PREFIX + data).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def _next_level(level):
+    # an odd node at the end of a level moves up unchanged
+    paired = [node_hash(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        paired.append(level[-1])
+    return paired
+
+
+def merkle_root(leaves):
+    """
+    :param leaves: <list> of leaf hashes as bytes
+    :return: <str> hex root, the hash of nothing for an empty list
+    """
+    if not leaves:
+        return hashlib.sha256(b'').hexdigest()
+    level = list(leaves)
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0].hex()
+
+
+def merkle_proof(leaves, index):
+    """
+    Inclusion proof of a leaf, logarithmic in the number of leaves
+    :param leaves: <list> of leaf hashes as bytes
+    :param index: <int> position of the leaf
+    :return: <list> of {'hash': <hex>, 'position': 'left'|'right'}, sibling hashes from the leaf up
+    """
+    if not 0 <= index < len(leaves):
+        raise IndexError('leaf index out of range')
+    proof = []
+    level = list(leaves)
+    while len(level) > 1:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append({'hash': level[sibling].hex(), 'position': 'left' if sibling < index else 'right'})
+        level = _next_level(level)
+        index //= 2
+    return proof
+
+
+def verify_proof(leaf, proof, root):
+    """
+    Checks an inclusion proof
+    :param leaf: <bytes> leaf hash
+    :param proof: <list> as returned by merkle_proof
+    :param root: <str> hex merkle root the leaf should be included in
+    :return: <bool>
+    """
+    current = leaf
+    try:
+        for step in proof:
+            sibling = bytes.fromhex(step['hash'])
+            if step['position'] == 'left':
+                current = node_hash(sibling, current)
+            elif step['position'] == 'right':
+                current = node_hash(current, sibling)
+            else:
+                return False
+    except (KeyError, TypeError, ValueError):
+        return False
+    return current.hex() == root
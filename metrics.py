@@ -0,0 +1,194 @@
+from bisect import bisect_left
+from functools import wraps
+from time import perf_counter
+import threading
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# upper bounds of the default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Timer(object):
+    # context manager observing the time spent in its block
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(perf_counter() - self.started, **self.labels)
+
+
+def timed(histogram):
+    """
+    Decorator observing the duration of every call in a histogram
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with histogram.time():
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class Metric(object):
+    type = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+
+    def samples(self):
+        """
+        :return: <list> of (suffix, labels, value)
+        """
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [('', key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def samples(self):
+        with self._lock:
+            return [('', key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+    """
+    Cumulative histogram, one set of buckets per combination of label values
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per bucket counts, +Inf bucket count last], sum
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+
+    def time(self, **labels):
+        """
+        with histogram.time(): ... observes the duration of the block in seconds
+        """
+        return _Timer(self, labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    samples.append(('_bucket', key + (('le', _format_value(float(bound))),), cumulative))
+                samples.append(('_sum', key, total))
+                samples.append(('_count', key, cumulative))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        """
+        :return: <str> every metric in the Prometheus text exposition format
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = Registry()
+
+POW_SECONDS = REGISTRY.histogram('blockchain_pow_duration_seconds', 'Time spent finding a proof of work')
+POW_HASHES = REGISTRY.histogram('blockchain_pow_hashes', 'Nonces tried to find a proof of work',
+                                buckets=tuple(10 ** i for i in range(2, 11)))
+CONSENSUS_SECONDS = REGISTRY.histogram('blockchain_consensus_round_seconds', 'Duration of a resolve_conflicts round')
+PEER_REQUEST_SECONDS = REGISTRY.histogram('blockchain_peer_request_seconds', 'Latency of requests to peer nodes')
+PEER_REQUEST_FAILURES = REGISTRY.counter('blockchain_peer_request_failures_total', 'Failed requests to peer nodes')
+VALIDATION_SECONDS = REGISTRY.histogram('blockchain_block_validation_seconds', 'Time spent in valid_chain')
+VALIDATION_BLOCKS = REGISTRY.histogram('blockchain_block_validation_blocks', 'Blocks checked by a valid_chain call',
+                                       buckets=(1, 2, 5, 10, 100, 1000, 10000, 100000))
+SIGNATURE_SECONDS = REGISTRY.histogram('blockchain_signature_verification_seconds',
+                                       'Time spent verifying a batch of transaction signatures')
+CHAIN_HEIGHT = REGISTRY.gauge('blockchain_chain_height', 'Number of blocks in our chain')
+PENDING_TRANSACTIONS = REGISTRY.gauge('blockchain_pending_transactions', 'Transactions in the pending pool')
+PEERS = REGISTRY.gauge('blockchain_peers', 'Registered peer nodes')
+GOSSIP_MESSAGES = REGISTRY.counter('blockchain_gossip_messages_total', 'Gossip messages sent to peers, by message type')
+GOSSIP_ITEMS = REGISTRY.counter('blockchain_gossip_items_total', 'Transactions and blocks sent in gossip messages')
@@ -0,0 +1,136 @@
+from time import time
+import multiprocessing
+import os
+import queue
+import threading
+import hashkernel
+
+
+def _worker(worker_id, workers, last_proof, difficulty, chunk_size, stop_event, results, hashes):
+    """
+    Worker process loop. The nonce space is split into chunks of chunk_size and
+    every worker takes the chunks worker_id, worker_id + workers, ... so that the
+    workers together cover every nonce exactly once.
+    """
+    chunk = worker_id
+    while not stop_event.is_set():
+        start = chunk * chunk_size
+        proof, tried = hashkernel.search(last_proof, start, start + chunk_size, difficulty)
+        with hashes.get_lock():
+            hashes.value += tried
+        if proof is not None:
+            results.put(proof)
+            return
+        chunk += workers
+
+
+class MiningCancelled(Exception):
+    pass
+
+
+class ParallelMiner(object):
+    # number of worker processes, defaults to the number of cores
+    workers = os.cpu_count() or 1
+
+    # nonces handed to a worker at a time, also bounds how long a worker
+    # keeps hashing after the job was cancelled
+    chunk_size = 20000
+
+    # how often the coordinator checks for a result or a cancellation, in seconds
+    poll_interval = 0.05
+
+    def __init__(self, workers=None, chunk_size=None):
+        self.workers = workers or self.workers
+        self.chunk_size = chunk_size or self.chunk_size
+        self._ctx = multiprocessing.get_context()
+        self._lock = threading.Lock()
+        # cancel token of the running or prepared job
+        self._stop_event = None
+        self._running = False
+        self.last_hashes = 0
+        self.last_duration = 0.0
+
+    @property
+    def hashrate(self):
+        """
+        Hashes per second achieved by the last mining job
+        :return: <float>
+        """
+        if not self.last_duration:
+            return 0.0
+        return self.last_hashes / self.last_duration
+
+    @property
+    def is_mining(self):
+        return self._running
+
+    def cancel(self):
+        """
+        Aborts the running mining job, if any. Safe to call from any thread.
+        :return: <bool> True if a job was cancelled
+        """
+        with self._lock:
+            if self._stop_event is None:
+                return False
+            self._stop_event.set()
+            return True
+
+    def prepare(self):
+        """
+        Creates the cancel token of the next job ahead of mine(), so a cancel() coming
+        while the caller still builds the job's template aborts that job too
+        """
+        with self._lock:
+            if self._running:
+                raise Exception('A mining job is already running')
+            self._stop_event = self._ctx.Event()
+
+    def mine(self, last_proof, difficulty):
+        """
+        Finds a proof for last_proof using all the worker processes.
+        Blocks until a proof is found or the job is cancelled.
+        :param last_proof: <int> Previous proof
+        :param difficulty: <int> number of leading hex zeroes required
+        :return: <int> proof
+        :raises MiningCancelled: if cancel() was called before a proof was found
+        """
+        results = self._ctx.Queue()
+        hashes = self._ctx.Value('Q', 0)
+        with self._lock:
+            if self._running:
+                raise Exception('A mining job is already running')
+            if self._stop_event is None:
+                self._stop_event = self._ctx.Event()
+            stop_event = self._stop_event
+            self._running = True
+
+        started = time()
+        # a job cancelled since prepare() starts no workers
+        processes = [] if stop_event.is_set() else [self._ctx.Process(target=_worker, daemon=True,
+                                       args=(i, self.workers, last_proof, difficulty,
+                                             self.chunk_size, stop_event, results, hashes))
+                     for i in range(self.workers)]
+        proof = None
+        try:
+            for p in processes:
+                p.start()
+            while proof is None and not stop_event.is_set():
+                try:
+                    proof = results.get(timeout=self.poll_interval)
+                except queue.Empty:
+                    # the workers also exit when the job gets cancelled
+                    if not stop_event.is_set() and not any(p.is_alive() for p in processes):
+                        raise Exception('All mining workers exited without a proof')
+        finally:
+            stop_event.set()
+            for p in processes:
+                p.join()
+            with self._lock:
+                self._stop_event = None
+                self._running = False
+            self.last_hashes = hashes.value
+            self.last_duration = time() - started
+
+        if proof is None:
+            raise MiningCancelled('Mining was cancelled')
+        return proof
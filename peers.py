@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+from time import monotonic, sleep
+from urllib.parse import urlparse
+import os
+import random
+import threading
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+
+
+class PeerUnavailable(Exception):
+    pass
+
+
+class PeerHealth(object):
+    """
+    Latency and failure tracking of a single peer
+    """
+    # weight of the newest sample in the latency moving average
+    latency_weight = 0.3
+
+    # first back off after a failure, doubled for every further failure, in seconds
+    backoff_base = 1.0
+    backoff_max = 60.0
+
+    def __init__(self):
+        self.latency = None
+        self.failures = 0
+        self.backoff_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def record_success(self, elapsed):
+        self.requests += 1
+        self.failures = 0
+        self.backoff_until = 0.0
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += self.latency_weight * (elapsed - self.latency)
+
+    def record_failure(self):
+        self.requests += 1
+        self.errors += 1
+        self.failures += 1
+        backoff = min(self.backoff_max, self.backoff_base * 2 ** (self.failures - 1))
+        self.backoff_until = monotonic() + backoff
+
+    @property
+    def available(self):
+        return monotonic() >= self.backoff_until
+
+    def get_details(self):
+        return {
+            'latency': self.latency,
+            'failures': self.failures,
+            'backoff': max(0.0, self.backoff_until - monotonic()),
+            'requests': self.requests,
+            'errors': self.errors
+        }
+
+
+class PeerClient(object):
+    """
+    HTTP client for talking to peer nodes.
+    Every peer gets its own keep-alive connection pool, requests carry a timeout,
+    and calls to many peers run concurrently on a thread pool.
+    Peers that keep failing are backed off and skipped until their back off expires.
+    """
+    # (connect, read) timeout of a single request, in seconds
+    timeout = (2.0, 10.0)
+
+    # threads used to fan requests out to peers
+    max_workers = 16
+
+    # keep-alive connections kept per peer
+    pool_size = 4
+
+    # fault injection for cluster simulations: delay added to every request, in seconds,
+    # and share of the requests failing as if the peer was down
+    injected_latency = float(os.environ.get('BLOCKCHAIN_PEER_LATENCY', 0))
+    injected_failure_rate = float(os.environ.get('BLOCKCHAIN_PEER_FAILURE_RATE', 0))
+
+    def __init__(self, timeout=None, max_workers=None):
+        self.timeout = timeout or self.timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or self.max_workers)
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self.health = {}
+
+    @staticmethod
+    def netloc(peer):
+        """
+        :param peer: <str> netloc like '127.0.0.1:5000' or an address like 'http://127.0.0.1:5000/'
+        :return: <str> netloc of the peer
+        """
+        return urlparse(peer).netloc if '//' in peer else peer.rstrip('/')
+
+    def _session(self, peer):
+        with self._lock:
+            session = self._sessions.get(peer)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._sessions[peer] = session
+                self.health[peer] = PeerHealth()
+            return session
+
+    def get_health(self, peer):
+        self._session(self.netloc(peer))
+        return self.health[self.netloc(peer)]
+
+    def is_available(self, peer):
+        return self.get_health(peer).available
+
+    def by_latency(self, peers):
+        """
+        Available peers, fastest first, peers we have not talked to yet come last
+        :param peers: iterable of peers
+        :return: <list> of netlocs
+        """
+        available = [self.netloc(p) for p in peers if p and self.is_available(p)]
+        return sorted(available, key=lambda p: (self.health[p].latency is None, self.health[p].latency or 0))
+
+    def request(self, peer, method, path, timeout=None, **kwargs):
+        """
+        Sends a request to a peer and records its latency or failure
+        :param peer: <str> netloc or address of the peer
+        :param method: <str> HTTP method
+        :param path: <str> path on the peer, e.g. '/chain/tip'
+        :param timeout: per request timeout, defaults to PeerClient.timeout
+        :return: <requests.Response>
+        :raises PeerUnavailable: if the peer is backed off or the request failed
+        """
+        peer = self.netloc(peer)
+        session = self._session(peer)
+        health = self.health[peer]
+        if not health.available:
+            raise PeerUnavailable(f'Peer node {peer} is backed off after {health.failures} failures')
+
+        if self.injected_failure_rate and random.random() < self.injected_failure_rate:
+            health.record_failure()
+            metrics.PEER_REQUEST_FAILURES.inc(peer=peer)
+            raise PeerUnavailable(f'Peer node {peer} did not respond: injected failure')
+
+        started = monotonic()
+        if self.injected_latency:
+            sleep(self.injected_latency)
+        try:
+            response = session.request(method, f'http://{peer}{path}', timeout=timeout or self.timeout, **kwargs)
+        except requests.RequestException as exp:
+            health.record_failure()
+            metrics.PEER_REQUEST_FAILURES.inc(peer=peer)
+            raise PeerUnavailable(f'Peer node {peer} did not respond: {exp}')
+        elapsed = monotonic() - started
+        metrics.PEER_REQUEST_SECONDS.observe(elapsed, peer=peer)
+        if response.status_code >= 500:
+            health.record_failure()
+            metrics.PEER_REQUEST_FAILURES.inc(peer=peer)
+        else:
+            health.record_success(elapsed)
+        return response
+
+    def get(self, peer, path, **kwargs):
+        return self.request(peer, 'GET', path, **kwargs)
+
+    def post(self, peer, path, **kwargs):
+        return self.request(peer, 'POST', path, **kwargs)
+
+    def fan_out(self, peers, method, path, deadline=None, **kwargs):
+        """
+        Sends the same request to many peers concurrently.
+        Backed off peers are skipped, and peers that did not answer before the
+        deadline are reported as failed.
+        :param peers: iterable of peers
+        :param method: <str> HTTP method
+        :param path: <str> path on the peers
+        :param deadline: <float> seconds to wait for all the answers, defaults to the read timeout
+        :return: <dict> netloc -> requests.Response or the exception raised for that peer
+        """
+        if deadline is None:
+            timeout = kwargs.get('timeout') or self.timeout
+            deadline = sum(timeout) if isinstance(timeout, tuple) else timeout
+        calls = {peer: partial(self.request, peer, method, path, **kwargs) for peer in self.by_latency(peers)}
+        return self.gather(calls, deadline)
+
+    def gather(self, calls, deadline=None):
+        """
+        Runs a different exchange with every peer concurrently, on the fan out thread pool
+        :param calls: <dict> netloc -> callable talking to that peer
+        :param deadline: <float> seconds to wait for all of them, defaults to the read and connect timeouts
+        :return: <dict> netloc -> what the callable returned or the exception it raised
+        """
+        futures = {self._executor.submit(call): peer for peer, call in calls.items()}
+        if deadline is None:
+            deadline = sum(self.timeout) if isinstance(self.timeout, tuple) else self.timeout
+        done, not_done = wait(futures, timeout=deadline)
+
+        results = {}
+        for future in done:
+            exp = future.exception()
+            results[futures[future]] = exp if exp is not None else future.result()
+        for future in not_done:
+            peer = futures[future]
+            self.get_health(peer).record_failure()
+            results[peer] = PeerUnavailable(f'Peer node {peer} missed the {deadline}s deadline')
+        return results
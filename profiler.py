@@ -0,0 +1,94 @@
+from collections import Counter
+import sys
+import threading
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler of the node's threads.
+    While running, a background thread snapshots the stack of every other thread
+    at a fixed interval and counts identical stacks. The result is in the folded
+    format flame graph tools read, one 'outer;...;inner count' line per stack.
+    It costs nothing while stopped and can be started and stopped at runtime.
+    """
+    # seconds between two samples
+    interval = 0.01
+
+    # deepest stack frames kept per sample
+    max_depth = 64
+
+    def __init__(self, interval=None):
+        self.interval = interval or self.interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        self._stop = None
+        self._thread = None
+
+    @property
+    def is_running(self):
+        return self._thread is not None
+
+    def start(self, interval=None):
+        """
+        :param interval: <float> seconds between two samples
+        :return: <bool> False if the profiler was already running
+        """
+        with self._lock:
+            if self._thread is not None:
+                return False
+            if interval:
+                self.interval = interval
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), name='sampling-profiler',
+                                            daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return False
+            self._stop.set()
+        thread.join()
+        return True
+
+    def reset(self):
+        with self._lock:
+            self.stacks.clear()
+            self.samples = 0
+
+    def _stack_of(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self, stop):
+        own_id = threading.get_ident()
+        while not stop.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = [self._stack_of(frame) for thread_id, frame in frames.items() if thread_id != own_id]
+            with self._lock:
+                self.stacks.update(stacks)
+                self.samples += 1
+
+    def get_folded(self, limit=None):
+        """
+        :param limit: <int> most frequent stacks to return, None for all of them
+        :return: <str> one 'frame;frame;frame count' line per distinct stack, most frequent first
+        """
+        with self._lock:
+            stacks = self.stacks.most_common(limit)
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks)
+
+    def get_details(self):
+        return {
+            'running': self.is_running,
+            'interval': self.interval,
+            'samples': self.samples,
+            'stacks': len(self.stacks)
+        }
@@ -0,0 +1,261 @@
+from collections import OrderedDict, deque
+from itertools import count
+from time import time
+import logging
+import threading
+from blockchain import Transaction
+from miner import MiningCancelled
+
+logger = logging.getLogger(__name__)
+
+
+class MiningJob(object):
+    """
+    A request for one block. The job keeps mining on top of the current tip
+    until a block is forged, restarting whenever the tip changes under it.
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        # queued, mining, found, cancelled or failed
+        self.status = 'queued'
+        self.created = time()
+        self.started = None
+        self.finished = None
+        # tip the current attempt builds on
+        self.index = None
+        self.previous_hash = None
+        self.transactions = 0
+        # attempts abandoned because the tip changed
+        self.restarts = 0
+        self.hashes = 0
+        self.block = None
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """
+        :param timeout: <float> seconds, None to wait until the job ends
+        :return: <bool> True if the job ended
+        """
+        return self._done.wait(timeout)
+
+    def finish(self, status, block=None, error=None):
+        self.status = status
+        self.block = block
+        self.error = error
+        self.finished = time()
+        self._done.set()
+
+    def get_details(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'transactions': self.transactions,
+            'restarts': self.restarts,
+            'hashes': self.hashes,
+            'block': self.block.hash if self.block is not None else None,
+            'error': self.error
+        }
+
+
+class MiningScheduler(object):
+    """
+    Background mining worker.
+    Jobs are mined one at a time by a single thread, either on demand (submit)
+    or back to back in continuous mode (start/stop), so the API keeps serving
+    requests while a proof is searched for. Every attempt mines a template made
+    of the mining reward and a snapshot of the top pending transactions, and is
+    abandoned as soon as the tip of the chain changes.
+    Forging goes through the chain's write lock and is skipped when the tip moved
+    after the proof was found, so a stale block never reaches the chain.
+    """
+    # finished jobs kept for the status API
+    max_jobs = 100
+
+    def __init__(self, blockchain, miner, reward_address, announce=None):
+        """
+        :param blockchain: <Blockchain>
+        :param miner: <ParallelMiner> the blockchain's proof_of_work runs on
+        :param reward_address: <str> wallet address credited with the mining rewards
+        :param announce: optional callable receiving every block we forge
+        """
+        self.blockchain = blockchain
+        self.miner = miner
+        self.reward_address = reward_address
+        self.announce = announce
+        self.continuous = False
+        self.current = None
+        self.jobs = OrderedDict()
+        self._queue = deque()
+        self._ids = count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        # hash of the block the running attempt builds on
+        self._template_tip = None
+        blockchain.tip_listeners.append(self._tip_changed)
+
+    def _ensure_thread(self):
+        # called with the lock held
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='mining-scheduler', daemon=True)
+            self._thread.start()
+
+    def _new_job(self):
+        # called with the lock held
+        job = MiningJob(next(self._ids))
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.max_jobs:
+            oldest = next(iter(self.jobs.values()))
+            if not oldest.done:
+                break
+            self.jobs.popitem(last=False)
+        return job
+
+    def submit(self):
+        """
+        Queues a request for one block
+        :return: <MiningJob>
+        """
+        with self._wakeup:
+            job = self._new_job()
+            self._queue.append(job)
+            self._ensure_thread()
+            self._wakeup.notify()
+        return job
+
+    def start(self):
+        """
+        Mines blocks back to back until stop() is called
+        """
+        with self._wakeup:
+            self.continuous = True
+            self._ensure_thread()
+            self._wakeup.notify()
+
+    def stop(self):
+        """
+        Leaves continuous mode and cancels the running and the queued jobs
+        :return: <int> number of jobs cancelled
+        """
+        with self._wakeup:
+            self.continuous = False
+            cancelled = list(self._queue)
+            self._queue.clear()
+            if self.current is not None:
+                cancelled.append(self.current)
+        for job in cancelled:
+            if not job.done:
+                job.finish('cancelled')
+        self.miner.cancel()
+        return len(cancelled)
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def get_status(self):
+        current = self.current
+        return {
+            'continuous': self.continuous,
+            'mining': self.miner.is_mining,
+            'current': current.get_details() if current is not None else None,
+            'queued': len(self._queue),
+            'hashrate': self.miner.hashrate
+        }
+
+    def _tip_changed(self, last_block):
+        # runs under the chain's write lock, must not block
+        if self._template_tip is not None and last_block.hash != self._template_tip:
+            self.miner.cancel()
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                while not self._queue and not self.continuous:
+                    self._wakeup.wait()
+                job = self._queue.popleft() if self._queue else self._new_job()
+                self.current = job
+            try:
+                self._mine(job)
+            except Exception as exp:
+                logger.warning(f'Mining job {job.id} failed: {exp}')
+                if not job.done:
+                    job.finish('failed', error=str(exp))
+            finally:
+                self._template_tip = None
+                with self._lock:
+                    self.current = None
+
+    def _template(self):
+        """
+        Snapshot of the tip and of the transactions the next block would hold
+        :return: <tuple> (last block, list of Transaction with the mining reward first)
+        """
+        blockchain = self.blockchain
+        with blockchain.lock:
+            last_block = blockchain.last_block
+            self._template_tip = last_block.hash
+            reward = Transaction.create('System', self.reward_address, blockchain.mining_reward)
+            pending = blockchain.select_transactions(blockchain.block_max_transactions - 1, blockchain.block_max_bytes)
+        return last_block, [reward] + pending
+
+    def _forge(self, last_block, transactions, proof):
+        """
+        :return: <Block> the new block, or None if the tip moved since the template was made
+        """
+        blockchain = self.blockchain
+        with blockchain.lock:
+            if blockchain.last_block.hash != last_block.hash:
+                return None
+            return blockchain.new_block(index=last_block.index + 1, transaction=transactions,
+                                        proof=proof, previous_hash=last_block.hash)
+
+    def _mine(self, job):
+        job.status = 'mining'
+        job.started = time()
+
+        # make sure we mine on top of the heaviest chain we can get
+        if self.blockchain.nodes:
+            try:
+                self.blockchain.resolve_conflicts()
+            except Exception as exp:
+                logger.warning(f'Consensus before mining failed: {exp}')
+
+        while not job.done:
+            # the cancel token exists before the template is taken, a tip change
+            # in between cancels the attempt instead of letting it mine a stale block
+            self.miner.prepare()
+            last_block, transactions = self._template()
+            job.index = last_block.index + 1
+            job.previous_hash = last_block.hash
+            job.transactions = len(transactions)
+            try:
+                proof = self.blockchain.proof_of_work(last_block.proof)
+            except MiningCancelled:
+                job.hashes += self.miner.last_hashes
+                job.restarts += 1
+                continue
+            job.hashes += self.miner.last_hashes
+            if job.done:
+                break
+
+            block = self._forge(last_block, transactions, proof)
+            if block is None:
+                job.restarts += 1
+                continue
+            if self.announce is not None:
+                try:
+                    self.announce(block)
+                except Exception as exp:
+                    logger.warning(f'Announcing block {block.index} failed: {exp}')
+            job.finish('found', block=block)
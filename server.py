@@ -1,13 +1,29 @@
-from flask import Flask, request, render_template, redirect
+from flask import Flask, Response, request, render_template, redirect
 import random
-from blockchain import Blockchain, ComplexEncoder
+from blockchain import Block, Blockchain, ComplexEncoder
 import json
-import requests
+import logging
+import os
+from numbers import Number
 from keygenerator import keygenerator
+from miner import ParallelMiner
+from scheduler import MiningScheduler
+from blockstore import BlockStore
+from peers import PeerClient, PeerUnavailable
+from mempool import DuplicateTransaction, MempoolFull
+from ledger import InsufficientFunds, amount_of
+from profiler import SamplingProfiler
+from gossip import BLOCK, TRANSACTION, GossipRelay
+import metrics
+import requests
+import wire
 
 
 app = Flask(__name__)
 
+# BLOCKCHAIN_LOG_LEVEL=DEBUG logs every block pair checked while validating chains
+logging.basicConfig(level=os.environ.get('BLOCKCHAIN_LOG_LEVEL', 'WARNING').upper())
+
 # Generate random seed to feed the key gen
 private_value = random.randint(1,10000)
 
@@ -20,61 +36,153 @@ node_wallet_id = KG.get_public_key()
 if node_wallet_id is None or len(node_wallet_id) == 0:
     raise Exception('Node server unable to generate valid wallet ID')
 
-# Init the blockchain
-blockchain = Blockchain()
+NDJSON = 'application/x-ndjson'
 
+# most transactions accepted by a single /transactions/batch request
+TRANSACTION_BATCH_LIMIT = 1000
 
-@app.route('/mine', methods=['GET'])
-def mine():
-    # check for consensus with peer nodes before mining
-    # ensures we have the largest blockchain copy
-    if len(blockchain.nodes) != 0:
-        consensus_response, status_code = consensus()
-        if status_code != 200:
-            return consensus_response, 400
 
-    # we run proof of work algo to get the next proof
-    last_proof = blockchain.last_block.proof
-    proof = blockchain.proof_of_work(last_proof)
+def negotiate():
+    """
+    Content negotiation between JSON, newline delimited JSON and the binary wire format
+    :return: <str> mimetype to answer with
+    """
+    return request.accept_mimetypes.best_match(['application/json', NDJSON, wire.CONTENT_TYPE]) or 'application/json'
+
+
+def binary_response(payload, status_code):
+    return Response(payload, status=status_code, mimetype=wire.CONTENT_TYPE)
+
+
+def stream_json_list(items, before, after):
+    """
+    Streams a JSON document holding one long list, item by item
+    :param items: iterable of JSON serializable objects
+    :param before: <str> JSON text up to the opening bracket of the list
+    :param after: <str> JSON text after the closing bracket of the list
+    :return: generator of <str>
+    """
+    yield before + '['
+    separator = ''
+    for item in items:
+        yield separator + json.dumps(item, cls=ComplexEncoder)
+        separator = ', '
+    yield ']' + after
+
+
+def stream_ndjson(first, items):
+    if first is not None:
+        yield json.dumps(first) + '\n'
+    for item in items:
+        yield json.dumps(item, cls=ComplexEncoder) + '\n'
+
+
+# proof of work difficulty and mining processes, cluster simulations lower both
+Blockchain.difficulty = int(os.environ.get('BLOCKCHAIN_DIFFICULTY', Blockchain.difficulty))
+miner_workers = os.environ.get('BLOCKCHAIN_MINER_WORKERS')
+
+# Init the miner and the blockchain, the chain is kept on disk when a data directory is given
+miner = ParallelMiner(workers=int(miner_workers) if miner_workers else None)
+data_dir = os.environ.get('BLOCKCHAIN_DATA_DIR')
+blockchain = Blockchain(miner=miner, store=BlockStore(data_dir) if data_dir else None)
 
-    # rewards for finding proof, sender is System to signify this node has mined a coin
-    blockchain.new_transaction(sender="System", receiver=node_wallet_id, amount=blockchain.mining_reward)
 
-    # forge new block by adding it to the chain
-    prev_hash = blockchain.hash(blockchain.last_block)
-    new_block = blockchain.new_block(proof=proof, previous_hash=prev_hash)
+# address the peers reach us at, taken from the first request when not configured
+node_address = os.environ.get('BLOCKCHAIN_NODE_ADDRESS')
 
-    # ours is longest chain now so announce new mined node to the peers
-    announce_resp, status_code = announce_new_block()
-    if status_code != 201:
-        return announce_resp, 400
 
+@app.before_request
+def remember_node_address():
+    global node_address
+    if node_address is None:
+        node_address = request.host
+
+
+@app.route('/mine', methods=['GET'])
+def mine():
+    """
+    Queues a request for one block on the background miner.
+    With ?wait=true the request blocks until the block is forged, as it used to.
+    """
+    job = scheduler.submit()
+    if request.args.get('wait', 'false').lower() not in ('true', '1'):
+        response = job.get_details()
+        response['status_url'] = f'/mine/jobs/{job.id}'
+        return json.dumps(response), 202
+
+    job.wait()
+    if job.status != 'found':
+        return f'Mining job {job.status}: {job.error}', 409 if job.status == 'cancelled' else 500
+
+    new_block = job.block
     response = {
         'message': "New Block Forged",
         'index': new_block.index,
         'transactions': [t.get_details() for t in new_block.transaction],
         'proof': new_block.proof,
         'previous_hash': new_block.previous_hash,
+        'hashes': job.hashes,
+        'hashrate': miner.hashrate,
     }
     return json.dumps(response, cls=ComplexEncoder), 200
 
 
-def announce_new_block():
+@app.route('/mine/jobs/<int:job_id>', methods=['GET'])
+def get_mining_job(job_id):
+    job = scheduler.get_job(job_id)
+    if job is None:
+        return 'Unknown mining job', 404
+    return json.dumps(job.get_details()), 200
+
+
+@app.route('/mine/status', methods=['GET'])
+def get_mining_status():
+    return json.dumps(scheduler.get_status()), 200
+
+
+@app.route('/mine/start', methods=['POST'])
+def start_mining():
+    # mine blocks back to back until /mine/stop
+    scheduler.start()
+    return json.dumps(scheduler.get_status()), 200
+
+
+@app.route('/mine/stop', methods=['POST'])
+def stop_mining():
+    cancelled = scheduler.stop()
+    return json.dumps({'cancelled': cancelled}), 200
+
+
+# new transactions and blocks are gossiped to a bounded number of random peers, which relay them further
+gossip_fanout = os.environ.get('BLOCKCHAIN_GOSSIP_FANOUT')
+gossip = GossipRelay(blockchain, origin=lambda: node_address, fanout=int(gossip_fanout) if gossip_fanout else None)
+blockchain.transaction_listeners.append(lambda tr: gossip.relay(TRANSACTION, tr.id))
+
+
+def announce_new_block(block):
     """
     A function to announce to the network once a block has been mined.
-    Other nodes can verify the longest chain and reach consensus
+    The block is gossiped right away instead of waiting for the next flush: its hash is
+    announced to a few random peers, which fetch it and relay it to a few of theirs.
+    Peers that find a gap or a fork sync incrementally from the node that sent them the block.
+    :param block: <Block> the new block
     """
-
-    headers = {'Content-Type': "application/json"}
-    for neighbour in blockchain.nodes:
-        url = f'http://{neighbour}/nodes/resolve'
-        response = requests.get(url, headers=headers)
-        if response.status_code != 200:
-            print(f'Message from peer node: {neighbour}, {response.text}, {response.reason}')
+    # peers that could not be reached are logged by the relay
+    gossip.relay(BLOCK, block.hash)
+    gossip.flush()
 
     return "Finished announcing new block to peer chains", 201
 
 
+# blocks are mined in the background, the API stays responsive while a proof is searched for
+scheduler = MiningScheduler(blockchain, miner, node_wallet_id, announce=announce_new_block)
+
+# sampling profiler, off unless BLOCKCHAIN_PROFILER=1 or turned on through /debug/profiler
+profiler = SamplingProfiler()
+if os.environ.get('BLOCKCHAIN_PROFILER') == '1':
+    profiler.start()
+
+
 @app.route('/blocks/add', methods=['POST'])
 def verify_and_add_block(block_obj=None):
     """
@@ -86,24 +194,78 @@ def verify_and_add_block(block_obj=None):
     """
     if block_obj:
         block_data = block_obj.get_details()
+    elif wire.is_binary(request.content_type):
+        try:
+            block_data = wire.decode_block(request.get_data())
+        except wire.WireError as exp:
+            return f'Invalid block: {exp}', 400
     else:
         block_data = request.get_json()
 
-    last_proof = blockchain.last_block.proof
-    last_hash = blockchain.hash(blockchain.last_block)
+    # check if the block to be added is valid for this blockchain: it has to extend our tip,
+    # carry a valid proof and only valid signed transactions.
+    # Blocks revealing a gap or a fork make us sync from the sending node.
+    origin = request.headers.get('X-Node-Address') if not block_obj else None
+    try:
+        block = Block.from_details(block_data)
+    except (KeyError, TypeError, ValueError) as exp:
+        return f'Invalid block: {exp}', 400
+    try:
+        outcome = blockchain.receive_block(block, origin)
+    except Exception as exp:
+        return f'Error occurred while syncing with the sending node: {exp}', 400
 
-    # check if the block to be added is valid for this blockchain
-    if last_hash != block_data['previous_hash'] or not blockchain.is_valid_proof(last_proof, block_data['proof']):
+    if outcome == 'known':
+        return "Block already in the peer's chain", 200
+    if outcome in ('rejected', 'orphan'):
         return "The block was discarded by the peer node, resolve conflicts with peers before adding", 400
-    else:
-        for tr in block_data['transactions']:
-            blockchain.new_transaction(tr['sender'], tr['receiver'], tr['amount'], private_value)
-        blockchain.new_block(index=block_data['index'], timestamp=block_data['timestamp'],
-                             proof=block_data['proof'], previous_hash=block_data['previous_hash'])
-
+    gossip.relay(BLOCK, block.hash, origin)
+    if outcome == 'side':
+        return "Block kept on a side branch of the peer's chain", 202
+
+    if outcome == 'synced':
+        return "Peer's chain synced with the sending node", 201
+    if outcome == 'reorganized':
+        return "Peer's chain switched to the block's branch", 201
     return "Block added to the peer's chain", 201
 
 
+@app.route('/gossip/inv', methods=['POST'])
+def gossip_inventory():
+    """
+    A peer announces transactions and blocks by ID: {"inventory": [["tx", id], ["block", hash]]}.
+    We answer with the ones we are missing, which the peer then sends to /gossip/data.
+    """
+    values = request.get_json()
+    inventory = values.get('inventory') if isinstance(values, dict) else None
+    if not isinstance(inventory, list) or len(inventory) > GossipRelay.max_batch:
+        return 'Invalid inventory', 400
+    if not all(isinstance(item, list) and len(item) == 2 and isinstance(item[1], str) for item in inventory):
+        return 'Invalid inventory', 400
+    return json.dumps({'want': gossip.wanted(inventory)}), 200
+
+
+@app.route('/gossip/data', methods=['POST'])
+def gossip_data():
+    """
+    A peer sends the transactions and blocks we asked for: {"transactions": [...], "blocks": [...]}.
+    The ones we accept are relayed to our own peers.
+    """
+    values = request.get_json()
+    if not isinstance(values, dict):
+        return 'Invalid data', 400
+    transactions = values.get('transactions', [])
+    blocks = values.get('blocks', [])
+    if not isinstance(transactions, list) or not isinstance(blocks, list):
+        return 'Invalid data', 400
+    accepted = gossip.receive(transactions, blocks, request.headers.get('X-Node-Address'))
+    return json.dumps(accepted), 200
+
+
+def valid_amount(amount):
+    return not isinstance(amount, bool) and isinstance(amount, Number) and amount > 0
+
+
 @app.route('/transactions/new', methods=['POST'])
 def new_transaction():
     values = request.get_json()
@@ -112,28 +274,251 @@ def new_transaction():
     # check request has all required values
     if not all(k in values for k in required):
         return 'Missing values', 400
+    amount = values['amount']
+    if not valid_amount(amount):
+        return 'Invalid amount', 400
 
-    index = blockchain.new_transaction(node_wallet_id, values['receiver'], values['amount'], private_value)
+    try:
+        index = blockchain.new_transaction(node_wallet_id, values['receiver'], amount, private_value)
+    except InsufficientFunds as exp:
+        return f'{exp}', 400
+    except MempoolFull as exp:
+        return f'{exp}', 503
     response = {'message': f'Transaction will be added to the Block {index}'}
 
     return json.dumps(response, cls=ComplexEncoder), 201
 
 
+@app.route('/transactions/batch', methods=['POST'])
+def new_transactions():
+    """
+    Adds many transactions in one request, they are signed with the node's cached key
+    and inserted into the pending pool in one operation.
+    Payments that are malformed, not covered by the balance or don't fit in the pool
+    are reported in their result and the rest of the batch goes through.
+    Payments identical to a pending transaction are reported as duplicates, they are not accepted again.
+    """
+    values = request.get_json()
+    payments = values.get('transactions') if isinstance(values, dict) else None
+    if not isinstance(payments, list) or len(payments) == 0:
+        return 'Missing values', 400
+    if len(payments) > TRANSACTION_BATCH_LIMIT:
+        return f'At most {TRANSACTION_BATCH_LIMIT} transactions per batch', 413
+
+    results = [None] * len(payments)
+    valid = []
+    for position, payment in enumerate(payments):
+        if not isinstance(payment, dict) or 'receiver' not in payment or 'amount' not in payment:
+            results[position] = {'error': 'Missing values'}
+        elif not valid_amount(payment['amount']):
+            results[position] = {'error': 'Invalid amount'}
+        else:
+            valid.append(position)
+
+    outcomes = blockchain.new_transactions(node_wallet_id,
+                                           [(payments[i]['receiver'], payments[i]['amount']) for i in valid],
+                                           private_value)
+    for position, outcome in zip(valid, outcomes):
+        if isinstance(outcome, DuplicateTransaction):
+            results[position] = {'duplicate': outcome.transaction_id}
+        elif isinstance(outcome, Exception):
+            results[position] = {'error': f'{outcome}'}
+        else:
+            results[position] = {'id': outcome.id}
+
+    accepted = sum(1 for result in results if 'id' in result)
+    duplicates = sum(1 for result in results if 'duplicate' in result)
+    response = {
+        'message': f'{accepted} of {len(payments)} transactions will be added to the Block {blockchain.last_block.index + 1}',
+        'accepted': accepted,
+        'duplicates': duplicates,
+        'results': results
+    }
+    return json.dumps(response), 201 if accepted else 400
+
+
 @app.route('/transactions/pending', methods=['GET'])
 def get_pending_transactions():
+    """
+    Pending transactions in the order they will be mined,
+    paged with `offset` and `limit`
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 0), 1000)
     resp = {
-        'Pending transactions': [t.get_details() for t in blockchain.currentTransactions]
+        'Pending transactions': [t.get_details() for t in blockchain.mempool.page(offset, limit)],
+        'offset': offset,
+        'limit': limit,
+        'total': len(blockchain.mempool)
     }
     return json.dumps(resp, cls=ComplexEncoder), 201
 
 
+@app.route('/transactions/<transaction_id>', methods=['GET'])
+def get_transaction(transaction_id):
+    """
+    A transaction by ID, confirmed along with the location of its block, or pending
+    """
+    found = blockchain.find_transaction(transaction_id)
+    if found is not None:
+        block, tr = found
+        response = {
+            'transaction': tr.get_details(),
+            'status': 'confirmed',
+            'block': block.index,
+            'block_hash': block.hash,
+            'confirmations': len(blockchain.chain) - block.index + 1
+        }
+        return json.dumps(response), 200
+
+    tr = blockchain.mempool.get(transaction_id)
+    if tr is not None:
+        return json.dumps({'transaction': tr.get_details(), 'status': 'pending'}), 200
+    return 'Transaction not found', 404
+
+
+@app.route('/transactions/<transaction_id>/proof', methods=['GET'])
+def get_transaction_proof(transaction_id):
+    """
+    Merkle inclusion proof of a confirmed transaction along with the header of its block.
+    It can be checked with merkle.verify_proof(blockchain.transaction_leaf(transaction), proof, merkle_root).
+    """
+    found = blockchain.find_transaction(transaction_id)
+    if found is None:
+        return 'Transaction not found in the chain', 404
+    block, tr = found
+    header = block.get_header()
+    header['hash'] = block.hash
+    response = {
+        'transaction': tr.get_details(),
+        'header': header,
+        'merkle_root': header['merkle_root'],
+        'proof': block.get_transaction_proof(transaction_id)
+    }
+    return json.dumps(response), 200
+
+
+@app.route('/balance/<address>', methods=['GET'])
+def get_balance(address):
+    """
+    Confirmed balance of a wallet and the amount its pending transactions will spend
+    """
+    response = {
+        'address': address,
+        'balance': blockchain.ledger.balance(address),
+        'pending': sum(amount_of(t) for t in blockchain.mempool.by_sender(address))
+    }
+    return json.dumps(response), 200
+
+
+@app.route('/balance/<address>/history', methods=['GET'])
+def get_balance_history(address):
+    """
+    Balance changes of a wallet, newest first, paged with `offset` and `limit`
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 0), 1000)
+    response = {
+        'address': address,
+        'history': blockchain.ledger.get_history(address, offset, limit)
+    }
+    return json.dumps(response), 200
+
+
+@app.route('/address/<address>/transactions', methods=['GET'])
+def get_address_transactions(address):
+    """
+    Confirmed transactions sent or received by a wallet, newest first, paged with `offset` and `limit`
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', 100, type=int), 0), 1000)
+    transactions = []
+    for block, tr in blockchain.address_transactions(address, offset, limit):
+        details = tr.get_details()
+        details['block'] = block.index
+        transactions.append(details)
+    response = {
+        'address': address,
+        'total': blockchain.chain_index.count_of(address),
+        'transactions': transactions
+    }
+    return json.dumps(response), 200
+
+
+def block_response(block, main_chain):
+    response = {
+        'block': block.get_details(),
+        'hash': block.hash,
+        'height': block.index,
+        'main_chain': main_chain,
+        'confirmations': len(blockchain.chain) - block.index + 1 if main_chain else 0
+    }
+    return json.dumps(response, cls=ComplexEncoder), 200
+
+
+@app.route('/blocks/<block_hash>', methods=['GET'])
+def get_block(block_hash):
+    """
+    A block by hash, from our chain or from a side branch we keep
+    """
+    found = blockchain.find_block(block_hash)
+    if found is None:
+        return 'Block not found', 404
+    return block_response(*found)
+
+
+@app.route('/blocks/height/<int:height>', methods=['GET'])
+def get_block_at_height(height):
+    """
+    The block of our chain at a height, the genesis block is at height 1
+    """
+    if not 1 <= height <= len(blockchain.chain):
+        return 'Block not found', 404
+    try:
+        block = blockchain.chain[height - 1]
+    except IndexError:
+        # the chain got shorter in the meantime
+        return 'Block not found', 404
+    return block_response(block, True)
+
+
 @app.route('/chain', methods=['GET'])
 def full_chain():
+    """
+    Serves the chain, or the part of it from block index `from` onwards.
+    `limit` caps the number of blocks and `headers=1` serves block headers only.
+    length is always the length of the whole chain.
+    The blocks are streamed one at a time as JSON, as newline delimited JSON
+    with the length in the X-Chain-Length header, or in the binary wire format,
+    depending on what the client accepts.
+    """
+    start = request.args.get('from', 1, type=int)
+    limit = request.args.get('limit', None, type=int)
+    headers_only = request.args.get('headers', 0, type=int) == 1
+
+    # the length and the range are taken together, the blocks are streamed after the lock is released
+    with blockchain.lock:
+        length = len(blockchain.chain)
+        positions = blockchain.block_range(start, limit)
+    blocks = blockchain.iter_blocks(positions, headers_only)
+    mimetype = negotiate()
+    if mimetype == wire.CONTENT_TYPE:
+        return binary_response(wire.iter_encode_chain(blocks, length, headers_only), 200)
+    if mimetype == NDJSON:
+        return Response(stream_ndjson(None, blocks), status=200, mimetype=NDJSON,
+                        headers={'X-Chain-Length': str(length)})
+    return Response(stream_json_list(blocks, '{"chain": ', f', "length": {length}}}'),
+                    status=200, mimetype='application/json')
+
+
+@app.route('/chain/tip', methods=['GET'])
+def chain_tip():
     response = {
-        'chain': [block.get_details() for block in blockchain.chain],
-        'length': len(blockchain.chain)
+        'height': len(blockchain.chain),
+        'hash': blockchain.last_block.hash,
+        'work': blockchain.chain_work()
     }
-    return json.dumps(response, cls=ComplexEncoder), 200
+    return json.dumps(response), 200
 
 
 @app.route('/nodes/register', methods=['POST'])
@@ -147,15 +532,22 @@ def register_nodes():
     for node in nodes:
         blockchain.register_node(node)
 
-    # Return the blockchain to the newly registered node so that it can sync
-    current_nodes_chain, status_code = full_chain()
-
-    response = {
-        'message': 'New nodes have been added',
-        'peer_nodes': list(blockchain.nodes),
-        'blockchain': json.loads(current_nodes_chain)
-    }
-    return json.dumps(response, cls=ComplexEncoder), 201
+    # Return the blockchain to the newly registered node so that it can sync,
+    # streamed the same way as /chain
+    peer_nodes = list(blockchain.nodes)
+    positions = blockchain.block_range()
+    length = len(positions)
+    blocks = blockchain.iter_blocks(positions)
+    mimetype = negotiate()
+    if mimetype == wire.CONTENT_TYPE:
+        return binary_response(wire.iter_encode_registration(peer_nodes, blocks, length), 201)
+    message = 'New nodes have been added'
+    if mimetype == NDJSON:
+        first = {'message': message, 'peer_nodes': peer_nodes, 'length': length}
+        return Response(stream_ndjson(first, blocks), status=201, mimetype=NDJSON)
+    before = json.dumps({'message': message, 'peer_nodes': peer_nodes})[:-1] + ', "blockchain": {"chain": '
+    return Response(stream_json_list(blocks, before, f', "length": {length}}}}}'),
+                    status=201, mimetype='application/json')
 
 
 @app.route('/nodes/register_with', methods=['POST'])
@@ -170,19 +562,32 @@ def register_with_existing_node():
     if not remote_node:
         return 'Invalid request data', 400
 
-    headers = {'Content-Type': "application/json"}
+    headers = {'Content-Type': "application/json", 'Accept': NDJSON}
     data = {'nodes': [request.host_url]}
-    response = requests.post(remote_node + '/nodes/register', data=json.dumps(data), headers=headers)
+    try:
+        response = blockchain.peers.post(remote_node, '/nodes/register', data=json.dumps(data), headers=headers,
+                                         stream=True)
+    except PeerUnavailable as exp:
+        return f'Error occurred while registering with remote node: {exp}', 502
 
     if response.status_code == 201:
+        # the reply is read one line at a time, only the parsed blocks are kept
+        with response:
+            lines = (line for line in response.iter_lines() if line)
+            try:
+                remote_chain_peers = json.loads(next(lines))['peer_nodes']
+                remote_chain = [Block.from_details(json.loads(line)) for line in lines]
+            except (StopIteration, KeyError, TypeError, ValueError, requests.RequestException) as exp:
+                return f'Invalid registration reply from remote node: {exp}', 502
+
         # build this nodes blockchain from the the remote's chain
-        remote_chain_dump = response.json()['blockchain']['chain']
-        blockchain.register_with_chain(remote_chain_dump)
+        blockchain.register_with_chain(remote_chain)
 
         # register remote's peer nodes to this nodes new_chain peers
-        remote_chain_peers = response.json()['peer_nodes']
         for peer in remote_chain_peers:
-            blockchain.register_node(peer)
+            # the remote node lists us among its peers too
+            if PeerClient.netloc(peer) != request.host:
+                blockchain.register_node(peer)
         # add the remote node if not present
         if remote_node not in blockchain.nodes:
             blockchain.register_node(remote_node)
@@ -190,36 +595,74 @@ def register_with_existing_node():
         # if something goes wrong, pass it on to the API response
         return response.content, response.status_code
 
-    # get new chain contents
-    new_chain, status_code = full_chain()
+    # stream the new chain contents one block at a time, as /nodes/register does
+    positions = blockchain.block_range()
+    length = len(positions)
+    before = json.dumps({'message': 'Blockchain has been registered with remote node'})[:-1] + \
+        ', "blockchain": {"chain": '
+    return Response(stream_json_list(blockchain.iter_blocks(positions), before, f', "length": {length}}}}}'),
+                    status=201, mimetype='application/json')
 
-    response = {
-        'message': 'Blockchain has been registered with remote node',
-        'blockchain': json.loads(new_chain)
-    }
-    return json.dumps(response, cls=ComplexEncoder), 201
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Metrics of the node in the Prometheus text format
+    """
+    metrics.CHAIN_HEIGHT.set(len(blockchain.chain))
+    metrics.PENDING_TRANSACTIONS.set(len(blockchain.mempool))
+    metrics.PEERS.set(len(blockchain.nodes))
+    return Response(metrics.REGISTRY.render(), status=200, content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/debug/profiler', methods=['GET'])
+def get_profile():
+    """
+    State of the sampling profiler, or with ?format=folded the sampled stacks
+    in the folded format flame graph tools read, `limit` keeps the most frequent ones
+    """
+    if request.args.get('format') == 'folded':
+        limit = request.args.get('limit', None, type=int)
+        return Response(profiler.get_folded(limit), status=200, mimetype='text/plain')
+    return json.dumps(profiler.get_details()), 200
+
+
+@app.route('/debug/profiler', methods=['POST'])
+def toggle_profiler():
+    """
+    Starts or stops the sampling profiler at runtime:
+    {"enabled": true, "interval": 0.01, "reset": true}
+    """
+    values = request.get_json() or {}
+    if values.get('reset'):
+        profiler.reset()
+    if 'enabled' in values:
+        if values['enabled']:
+            interval = values.get('interval')
+            if interval is not None and (not isinstance(interval, Number) or interval <= 0):
+                return 'Invalid interval', 400
+            profiler.start(interval)
+        else:
+            profiler.stop()
+    return json.dumps(profiler.get_details()), 200
 
 
 @app.route('/nodes/resolve', methods=['GET'])
 def consensus():
     try:
-        replaced = blockchain.resolve_conflicts(private_value)
+        replaced = blockchain.resolve_conflicts()
     except Exception as exp:
         return f'Error occurred while creating consensus: {exp}', 400
 
+    # the chain is streamed one block at a time like /chain
     if replaced:
-        response = {
-            'message': 'Our chain was replaced',
-            'new_chain': [block.get_details() for block in blockchain.chain],
-            'replaced': 'True'
-        }
+        before = '{"message": "Our chain was replaced", "new_chain": '
+        after = ', "replaced": "True"}'
     else:
-        response = {
-            'message': 'Our chain is authoritative',
-            'chain': [block.get_details() for block in blockchain.chain],
-            'replaced': 'False'
-        }
-    return json.dumps(response, cls=ComplexEncoder), 200
+        before = '{"message": "Our chain is authoritative", "chain": '
+        after = ', "replaced": "False"}'
+    blocks = blockchain.iter_blocks(blockchain.block_range())
+    return Response(stream_json_list(blocks, before, after), status=200, mimetype='application/json')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,83 @@
+import hashkernel
+from blockchain import Block, Blockchain, Transaction
+from ledger import InsufficientFunds
+from mempool import DuplicateTransaction
+from verifier import load_private_key
+
+
+def mined(parent, transactions, timestamp=1000):
+    proof, _ = hashkernel.search(parent.proof, 0, 1 << 32, Blockchain.difficulty)
+    return Block(index=parent.index + 1, timestamp=timestamp, transaction=transactions, proof=proof,
+                 previous_hash=parent.hash)
+
+
+def reward(address, amount=1, timestamp=1000):
+    return Transaction.create('System', address, amount, timestamp=timestamp)
+
+
+def payment(private_value, receiver, amount, timestamp=1001):
+    return Transaction.create(load_private_key(private_value)[1], receiver, amount, private_value, timestamp)
+
+
+def make_blockchain(monkeypatch):
+    monkeypatch.setattr(Blockchain, 'difficulty', 1)
+    return Blockchain()
+
+
+def test_block_overspending_its_sender_is_rejected(monkeypatch):
+    blockchain = make_blockchain(monkeypatch)
+    address = load_private_key(7)[1]
+    funded = mined(blockchain.last_block, [reward(address)])
+    assert blockchain.accept_block(funded) == 'added'
+
+    assert blockchain.accept_block(mined(funded, [payment(7, 'bob', 2)])) == 'rejected'
+    # two payments of the same sender are covered together
+    assert blockchain.accept_block(mined(funded, [payment(7, 'bob', 1), payment(7, 'carol', 1)])) == 'rejected'
+    assert blockchain.accept_block(mined(funded, [payment(7, 'bob', 1)])) == 'added'
+    assert blockchain.ledger.balance(address) == 0
+
+
+def test_block_with_extra_or_inflated_rewards_is_rejected(monkeypatch):
+    blockchain = make_blockchain(monkeypatch)
+    parent = blockchain.last_block
+
+    assert blockchain.accept_block(mined(parent, [reward('a'), reward('b', timestamp=1001)])) == 'rejected'
+    assert blockchain.accept_block(mined(parent, [reward('a', amount=1000)])) == 'rejected'
+    assert blockchain.ledger.balance('a') == 0
+
+
+def test_reorganization_to_an_overspending_branch_is_undone(monkeypatch):
+    blockchain = make_blockchain(monkeypatch)
+    genesis = blockchain.last_block
+    main = mined(genesis, [reward('miner')])
+    blockchain.accept_block(main)
+
+    side = mined(genesis, [reward('other')], timestamp=2000)
+    cheat = mined(side, [payment(7, 'bob', 5)], timestamp=2001)
+    assert blockchain.accept_block(side) == 'side'
+    assert blockchain.accept_block(cheat) == 'rejected'
+
+    assert blockchain.last_block.hash == main.hash
+    assert blockchain.ledger.balance('miner') == 1 and blockchain.ledger.balance('bob') == 0
+    assert blockchain.tree.get_side(side.hash) is not None
+    assert blockchain.tree.get_side(cheat.hash) is None
+
+
+def test_duplicate_payments_in_a_batch_are_not_committed(monkeypatch):
+    blockchain = make_blockchain(monkeypatch)
+    address = load_private_key(7)[1]
+    monkeypatch.setattr(Blockchain, 'mining_reward', 2)
+    blockchain.accept_block(mined(blockchain.last_block, [reward(address, amount=2)]))
+    # the same payment within the clock's resolution has the same ID
+    monkeypatch.setattr('blockchain.time', lambda: 1001)
+
+    first, duplicate, other = blockchain.new_transactions(address, [('bob', 1), ('bob', 1), ('carol', 1)], 7)
+    assert isinstance(first, Transaction)
+    assert isinstance(duplicate, DuplicateTransaction) and duplicate.transaction_id == first.id
+    # the duplicate doesn't count against the balance
+    assert isinstance(other, Transaction)
+    assert len(blockchain.mempool) == 2
+
+    again, = blockchain.new_transactions(address, [('bob', 1)], 7)
+    assert isinstance(again, DuplicateTransaction)
+    assert isinstance(blockchain.new_transactions(address, [('dave', 1)], 7)[0], InsufficientFunds)
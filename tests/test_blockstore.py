@@ -0,0 +1,52 @@
+import os
+from blockchain import Block
+from blockstore import RECORD_HEADER, RECORD_MAGIC, BlockStore, StoredChain
+
+
+def chain_of(count):
+    blocks = [Block(index=1, timestamp=1000, transaction=[], proof=100, previous_hash=1)]
+    for i in range(1, count):
+        blocks.append(Block(index=i + 1, timestamp=1000 + i, transaction=[], proof=i,
+                            previous_hash=blocks[-1].hash))
+    return blocks
+
+
+def stored(path, blocks):
+    store = BlockStore(path)
+    for block in blocks:
+        store.append(block.get_details(), block.hash)
+    store.close()
+
+
+def test_torn_final_record_is_dropped(tmp_path):
+    blocks = chain_of(3)
+    stored(tmp_path, blocks)
+    segment = os.path.join(tmp_path, BlockStore.segment_name)
+    size = os.path.getsize(segment)
+    with open(segment, 'ab') as f:
+        f.write(RECORD_HEADER.pack(RECORD_MAGIC, 256, 0) + b'{"index": 4')
+
+    store = BlockStore(tmp_path)
+    assert len(store) == 3
+    assert os.path.getsize(segment) == size
+    assert [block.hash for block in StoredChain(store, Block.from_details)] == [b.hash for b in blocks]
+
+    # the store keeps appending after the recovered tail
+    extra = chain_of(4)[-1]
+    store.append(extra.get_details(), extra.hash)
+    store.close()
+    assert BlockStore(tmp_path).get_hash(3) == extra.hash
+
+
+def test_records_written_after_the_index_are_reindexed(tmp_path):
+    blocks = chain_of(3)
+    stored(tmp_path, blocks)
+    index = os.path.join(tmp_path, BlockStore.index_name)
+    # the last index entry is lost and the one before it is half written
+    with open(index, 'r+b') as f:
+        f.truncate(os.path.getsize(index) * 2 // 3 - 5)
+
+    store = BlockStore(tmp_path)
+    assert len(store) == 3
+    assert [store.get_hash(i) for i in range(3)] == [block.hash for block in blocks]
+    assert store.position_of(blocks[2].hash) == 2
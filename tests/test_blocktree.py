@@ -0,0 +1,122 @@
+import pytest
+import hashkernel
+from blockchain import Block, Blockchain
+
+
+def child(parent, timestamp):
+    """
+    A block without transactions extending parent, mined at the test difficulty
+    """
+    proof, _ = hashkernel.search(parent.proof, 0, 1 << 32, Blockchain.difficulty)
+    return Block(index=parent.index + 1, timestamp=timestamp, transaction=[], proof=proof,
+                 previous_hash=parent.hash)
+
+
+def extend(parent, count, timestamp):
+    blocks = []
+    for i in range(count):
+        parent = child(parent, timestamp + i)
+        blocks.append(parent)
+    return blocks
+
+
+def make_blockchain(monkeypatch, max_reorg_depth=3):
+    monkeypatch.setattr(Blockchain, 'difficulty', 1)
+    monkeypatch.setattr(Blockchain, 'max_reorg_depth', max_reorg_depth)
+    return Blockchain()
+
+
+def test_heavier_side_branch_becomes_main_chain(monkeypatch):
+    blockchain = make_blockchain(monkeypatch)
+    genesis = blockchain.last_block
+    main = extend(genesis, 2, 1000)
+    side = extend(genesis, 3, 2000)
+    for block in main:
+        assert blockchain.accept_block(block) == 'added'
+
+    assert [blockchain.accept_block(block) for block in side] == ['side', 'side', 'reorganized']
+    assert blockchain.last_block.hash == side[-1].hash
+    assert blockchain.tree.get_side(main[-1].hash) is not None
+
+
+def test_pruned_side_branch_is_dropped_as_a_whole(monkeypatch):
+    blockchain = make_blockchain(monkeypatch)
+    genesis = blockchain.last_block
+    main = extend(genesis, 2, 1000)
+    side = extend(genesis, 2, 2000)
+    for block in main + side:
+        blockchain.accept_block(block)
+
+    # the side branch forks at the genesis block, more than max_reorg_depth below the new tip
+    for block in extend(main[-1], 3, 3000):
+        assert blockchain.accept_block(block) == 'added'
+    assert all(blockchain.tree.get_side(block.hash) is None for block in side)
+
+    # extending the forgotten branch past our chain's work no longer reaches a pruned block
+    tip = blockchain.last_block.hash
+    outcomes = [blockchain.accept_block(block) for block in extend(side[-1], 4, 4000)]
+    assert outcomes == ['orphan'] * 4
+    assert blockchain.last_block.hash == tip
+
+
+def test_side_branch_missing_an_ancestor_is_rejected(monkeypatch):
+    blockchain = make_blockchain(monkeypatch, max_reorg_depth=100)
+    genesis = blockchain.last_block
+    main = extend(genesis, 2, 1000)
+    side = extend(genesis, 2, 2000)
+    for block in main + side:
+        blockchain.accept_block(block)
+
+    blockchain.tree.remove_side(side[0].hash)
+    assert blockchain.accept_block(child(side[-1], 3000)) == 'rejected'
+    assert blockchain.last_block.hash == main[-1].hash
+
+
+def test_sync_verifies_the_suffix_signatures_in_one_job(monkeypatch):
+    blockchain = make_blockchain(monkeypatch, max_reorg_depth=100)
+    genesis = blockchain.last_block
+    for block in extend(genesis, 2, 1000):
+        blockchain.accept_block(block)
+    remote = extend(genesis, 4, 2000)
+    monkeypatch.setattr(blockchain, 'find_common_ancestor', lambda node: 1)
+    monkeypatch.setattr(blockchain, 'download_blocks', lambda node, start, stop: remote[start - 2:stop - 1])
+    jobs = []
+    verify_chain = blockchain.verifier.verify_chain
+    monkeypatch.setattr(blockchain.verifier, 'verify_chain', lambda blocks: jobs.append(len(blocks)) or verify_chain(blocks))
+
+    blockchain.sync_with('peer', 5)
+
+    assert jobs == [4]
+    assert blockchain.last_block.hash == remote[-1].hash
+
+
+def test_full_sync_refuses_a_lighter_chain(monkeypatch):
+    blockchain = make_blockchain(monkeypatch, max_reorg_depth=100)
+    for block in extend(blockchain.last_block, 3, 1000):
+        blockchain.accept_block(block)
+    tip = blockchain.last_block.hash
+    other_genesis = Block(index=1, timestamp=5, transaction=[], proof=100, previous_hash=1)
+    remote = [other_genesis] + extend(other_genesis, 2, 2000)
+    monkeypatch.setattr(blockchain, 'find_common_ancestor', lambda node: 0)
+    monkeypatch.setattr(blockchain, 'download_blocks', lambda node, start, stop: remote)
+
+    with pytest.raises(Exception):
+        blockchain.sync_with('peer', 100)
+    assert blockchain.last_block.hash == tip
+
+
+def test_streamed_blocks_stop_at_a_reorganization(monkeypatch):
+    blockchain = make_blockchain(monkeypatch)
+    genesis = blockchain.last_block
+    main = extend(genesis, 2, 1000)
+    side = extend(genesis, 3, 2000)
+    for block in main:
+        blockchain.accept_block(block)
+
+    blocks = blockchain.iter_blocks(blockchain.block_range())
+    assert next(blocks)['previous_hash'] == 1
+    assert next(blocks)['timestamp'] == main[0].timestamp
+    for block in side:
+        blockchain.accept_block(block)
+    # the next block of the new chain doesn't link to the replaced one already served
+    assert list(blocks) == []
@@ -0,0 +1,44 @@
+import hashkernel
+from blockchain import Block, Blockchain, Transaction
+from gossip import TRANSACTION, GossipRelay
+from verifier import load_private_key
+
+
+def make_payment(private_value, receiver, amount, timestamp):
+    return Transaction.create(load_private_key(private_value)[1], receiver, amount, private_value, timestamp)
+
+
+def reward_block(parent, address, amount):
+    reward = Transaction.create('System', address, amount, timestamp=1000)
+    proof, _ = hashkernel.search(parent.proof, 0, 1 << 32, Blockchain.difficulty)
+    return Block(index=parent.index + 1, timestamp=1000, transaction=[reward], proof=proof,
+                 previous_hash=parent.hash)
+
+
+def test_block_funding_a_transaction_of_the_same_message_is_applied_first(monkeypatch):
+    monkeypatch.setattr(Blockchain, 'difficulty', 1)
+    monkeypatch.setattr(Blockchain, 'mining_reward', 5)
+    blockchain = Blockchain()
+    relay = GossipRelay(blockchain)
+    address = load_private_key(7)[1]
+    block = reward_block(blockchain.last_block, address, 5)
+    payment = make_payment(7, 'bob', 3, 1001)
+
+    accepted = relay.receive([payment.get_details()], [block.get_details()])
+
+    assert accepted == {'transactions': 1, 'blocks': 1}
+    assert payment.id in blockchain.mempool
+
+
+def test_unfunded_transaction_can_be_received_again(monkeypatch):
+    monkeypatch.setattr(Blockchain, 'difficulty', 1)
+    blockchain = Blockchain()
+    relay = GossipRelay(blockchain)
+    payment = make_payment(7, 'bob', 3, 1001)
+
+    assert relay.receive([payment.get_details()], []) == {'transactions': 0, 'blocks': 0}
+    assert relay.wanted([[TRANSACTION, payment.id]]) == [[TRANSACTION, payment.id]]
+
+    forged = Transaction.from_details(dict(payment.get_details(), amount=4))
+    assert relay.receive([forged.get_details()], []) == {'transactions': 0, 'blocks': 0}
+    assert relay.wanted([[TRANSACTION, forged.id]]) == []
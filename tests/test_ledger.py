@@ -0,0 +1,36 @@
+from blockchain import Block, Transaction
+from ledger import Ledger
+
+
+def block(index, *payments):
+    transactions = [Transaction.create(sender, receiver, amount, timestamp=1000 + index)
+                    for sender, receiver, amount in payments]
+    return Block(index=index, timestamp=1000 + index, transaction=transactions, proof=0, previous_hash='00' * 32)
+
+
+def test_revert_undoes_apply_in_reverse_order():
+    ledger = Ledger()
+    first = block(2, ('System', 'alice', 5))
+    second = block(3, ('alice', 'bob', 2), ('bob', 'carol', 1))
+    ledger.apply_block(first)
+    ledger.apply_block(second)
+    assert [ledger.balance(a) for a in ('alice', 'bob', 'carol')] == [3, 1, 1]
+    assert [entry['amount'] for entry in ledger.get_history('bob')] == [-1, 2]
+
+    ledger.revert_block(second)
+    assert ledger.balances == {'alice': 5}
+    assert ledger.get_history('bob') == []
+    assert ledger.get_history('alice') == [{'block': 2, 'transaction': first.transaction[0].id, 'amount': 5}]
+
+    ledger.revert_block(first)
+    assert ledger.balances == {} and ledger.history == {}
+
+
+def test_history_pages_newest_first():
+    ledger = Ledger()
+    for index in range(2, 7):
+        ledger.apply_block(block(index, ('System', 'alice', index)))
+
+    assert [entry['block'] for entry in ledger.get_history('alice', offset=1, limit=2)] == [5, 4]
+    assert [entry['block'] for entry in ledger.get_history('alice', offset=4)] == [2]
+    assert ledger.get_history('alice', offset=9) == []
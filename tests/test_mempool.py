@@ -0,0 +1,57 @@
+import pytest
+from blockchain import Transaction
+from mempool import Mempool, MempoolFull
+
+
+def payment(receiver, sender='alice', timestamp=1000):
+    return Transaction.create(sender, receiver, 1, timestamp=timestamp)
+
+
+def test_the_lowest_ranking_transactions_are_evicted_first():
+    pool = Mempool(max_count=3)
+    first, second, third = payment('bob'), payment('carol'), payment('dave')
+    for tr in (first, second, third):
+        assert pool.add(tr)
+
+    reward = Transaction.create('System', 'miner', 1, timestamp=1000)
+    assert pool.add(reward)
+    assert [tr.id for tr in pool.page()] == [reward.id, first.id, second.id]
+
+    with pytest.raises(MempoolFull):
+        pool.add(payment('erin'))
+    assert len(pool) == 3
+
+
+def test_oversized_transaction_evicts_nothing():
+    pool = Mempool(max_bytes=400)
+    small = payment('bob')
+    pool.add(small)
+
+    with pytest.raises(MempoolFull):
+        pool.add(Transaction.create('System', 'x' * 500, 1, timestamp=1000))
+    assert [tr.id for tr in pool.page()] == [small.id]
+
+
+def test_rejected_add_leaves_the_pool_unchanged():
+    # smaller amounts rank higher
+    pool = Mempool(priority=lambda tr: tr.amount)
+    high = Transaction.create('alice', 'bob', 1, timestamp=1000)
+    low = Transaction.create('alice', 'bob', 5, timestamp=1000)
+    pool.max_bytes = pool._encoded_size(high) + pool._encoded_size(low)
+    pool.add(high)
+    pool.add(low)
+
+    # making room takes evicting both, the newcomer outranks the low one only
+    middle = Transaction.create('alice', 'c' * 80, 3, timestamp=1000)
+    with pytest.raises(MempoolFull):
+        pool.add(middle)
+    assert [tr.id for tr in pool.page()] == [high.id, low.id]
+    assert pool.size == pool.max_bytes
+
+
+def test_duplicate_is_reported():
+    pool = Mempool()
+    tr = payment('bob')
+    assert pool.add(tr) is True
+    assert pool.add(tr) is False
+    assert pool.add_many([tr, payment('carol')]) == [False, True]
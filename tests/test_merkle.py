@@ -0,0 +1,22 @@
+import pytest
+from merkle import leaf_hash, merkle_proof, merkle_root, verify_proof
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 6, 7, 9, 13])
+def test_every_leaf_has_a_valid_proof(size):
+    leaves = [leaf_hash(bytes([i])) for i in range(size)]
+    root = merkle_root(leaves)
+    for index, leaf in enumerate(leaves):
+        proof = merkle_proof(leaves, index)
+        assert verify_proof(leaf, proof, root)
+        # a proof only holds for its own leaf
+        assert not verify_proof(leaf_hash(b'other'), proof, root)
+
+
+def test_odd_leaf_moves_up_without_being_duplicated():
+    leaves = [leaf_hash(bytes([i])) for i in range(3)]
+    # duplicating the last leaf would give the same root to a different list
+    assert merkle_root(leaves) != merkle_root(leaves + leaves[-1:])
+    assert len(merkle_proof(leaves, 2)) == 1
+    with pytest.raises(IndexError):
+        merkle_proof(leaves, 3)
@@ -0,0 +1,22 @@
+import pytest
+from blockchain import Block, Transaction
+
+
+def test_transaction_fields_cannot_change_once_in_a_block():
+    tr = Transaction.create('System', 'alice', 1, timestamp=1000)
+    block = Block(index=2, timestamp=1000, transaction=[tr], proof=1, previous_hash='00' * 32)
+    block_hash = block.hash
+
+    with pytest.raises(AttributeError):
+        tr.receiver = 'mallory'
+    assert not hasattr(tr, 'set_transaction') and not hasattr(tr, 'sign_transaction')
+    assert Block.from_details(block.get_details()).hash == block_hash
+
+
+def test_transaction_round_trips_with_its_signature():
+    from verifier import load_private_key
+    tr = Transaction.create(load_private_key(11)[1], 'bob', 2, 11, 1000)
+
+    copy = Transaction.from_details(tr.get_details())
+    assert copy.is_valid()
+    assert copy.id == tr.id and copy.signature == tr.signature
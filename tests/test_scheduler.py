@@ -0,0 +1,46 @@
+import time
+from blockchain import Blockchain
+from miner import ParallelMiner
+from scheduler import MiningScheduler
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def make_scheduler(monkeypatch):
+    # no proof is found at this difficulty within the test
+    monkeypatch.setattr(Blockchain, 'difficulty', 16)
+    miner = ParallelMiner(workers=1, chunk_size=1000)
+    blockchain = Blockchain(miner=miner)
+    return blockchain, miner, MiningScheduler(blockchain, miner, 'miner')
+
+
+def test_stop_cancels_the_running_and_queued_jobs(monkeypatch):
+    blockchain, miner, scheduler = make_scheduler(monkeypatch)
+    running, queued = scheduler.submit(), scheduler.submit()
+    wait_for(lambda: miner.is_mining)
+
+    assert scheduler.stop() == 2
+    assert running.wait(5) and queued.wait(5)
+    assert running.status == queued.status == 'cancelled'
+    wait_for(lambda: not miner.is_mining and scheduler.current is None)
+    assert len(blockchain.chain) == 1
+
+
+def test_tip_change_restarts_the_attempt_on_the_new_tip(monkeypatch):
+    blockchain, miner, scheduler = make_scheduler(monkeypatch)
+    job = scheduler.submit()
+    wait_for(lambda: miner.is_mining)
+    genesis = blockchain.last_block
+
+    # a block from elsewhere extends the chain while the job mines on the genesis block
+    blockchain.new_block(proof=0, transaction=[], previous_hash=genesis.hash)
+    wait_for(lambda: job.restarts == 1 and job.previous_hash == blockchain.last_block.hash)
+    assert job.status == 'mining'
+
+    scheduler.stop()
+    assert job.wait(5) and job.status == 'cancelled'
@@ -0,0 +1,47 @@
+import pytest
+import wire
+from blockchain import Block, Transaction
+from verifier import load_private_key
+
+
+def sample_block():
+    transactions = [
+        Transaction.create('System', load_private_key(3)[1], 1, timestamp=1000),
+        Transaction.create(load_private_key(3)[1], 'bob', 0.5, 3, 1000.25),
+    ]
+    return Block(index=2, timestamp=1001, transaction=transactions, proof=42, previous_hash='ab' * 32)
+
+
+def test_block_and_chain_round_trip():
+    block = sample_block()
+    genesis = Block(index=1, timestamp=1000, transaction=[], proof=100, previous_hash=1)
+    details = [genesis.get_details(), block.get_details()]
+
+    assert wire.decode_block(wire.encode_block(details[1])) == details[1]
+    payload = b''.join(wire.iter_encode_chain(iter(details), 7))
+    assert wire.decode_chain(payload) == {'chain': details, 'length': 7}
+
+    header = dict(block.get_header(), hash=block.hash)
+    payload = b''.join(wire.iter_encode_chain([header], 2, headers_only=True))
+    assert wire.decode_chain(payload, True)['chain'] == [header]
+
+    payload = b''.join(wire.iter_encode_registration(['127.0.0.1:5001'], details, 2))
+    assert wire.decode_registration(payload) == {'peer_nodes': ['127.0.0.1:5001'],
+                                                 'blockchain': {'chain': details, 'length': 2}}
+
+
+def test_truncated_or_padded_messages_are_rejected():
+    block_payload = wire.encode_block(sample_block().get_details())
+    chain_payload = b''.join(wire.iter_encode_chain([sample_block().get_details()], 2))
+
+    for size in range(len(block_payload)):
+        with pytest.raises(wire.WireError):
+            wire.decode_block(block_payload[:size])
+    # a chain cut right after a block lacks its end tag
+    for size in range(len(chain_payload)):
+        with pytest.raises(wire.WireError):
+            wire.decode_chain(chain_payload[:size])
+    with pytest.raises(wire.WireError):
+        wire.decode_block(block_payload + b'\x00')
+    with pytest.raises(wire.WireError):
+        wire.decode_chain(block_payload)
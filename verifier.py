@@ -0,0 +1,173 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import os
+import threading
+import metrics
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat, load_der_public_key
+from cryptography.hazmat.primitives.asymmetric.ec import EllipticCurvePublicKey
+import cryptography.exceptions
+
+
+def signing_payload(sender, receiver, amount, timestamp):
+    """
+    Bytes a transaction signature is computed over
+    :return: <bytes>
+    """
+    return f'{sender}{receiver}{amount}{timestamp}'.encode()
+
+
+@lru_cache(maxsize=4096)
+def load_public_key(sender):
+    """
+    Parses a wallet address into a public key object, cached per sender
+    :param sender: <str> hex of the DER encoded public key
+    :return: <EllipticCurvePublicKey> or None if the address is not a valid key
+    """
+    try:
+        pub_key_obj = load_der_public_key(bytes.fromhex(sender), default_backend())
+    except ValueError:
+        return None
+    if not isinstance(pub_key_obj, EllipticCurvePublicKey):
+        return None
+    return pub_key_obj
+
+
+@lru_cache(maxsize=64)
+def load_private_key(private_value):
+    """
+    Derives the signing key of a private value, cached so a node signing many
+    transactions derives its key and serializes its address only once
+    :param private_value: <int>
+    :return: <tuple> (EllipticCurvePrivateKey, <str> wallet address the key signs for)
+    """
+    private_key_obj = ec.derive_private_key(private_value, ec.SECP256K1(), default_backend())
+    address = private_key_obj.public_key().public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo).hex()
+    return private_key_obj, address
+
+
+def sign_payload(private_value, sender, data):
+    """
+    :param private_value: <int> private value of the sender's wallet
+    :param sender: <str> wallet address the payload is signed for
+    :param data: <bytes> payload to sign
+    :return: <bytes> DER encoded ECDSA signature
+    """
+    private_key_obj, address = load_private_key(private_value)
+    if address != sender:
+        raise Exception('You cannot sign transactions for other wallets')
+    return private_key_obj.sign(data, ec.ECDSA(hashes.SHA256()))
+
+
+def verify_signature(sender, data, signature):
+    """
+    :param sender: <str> wallet address of the signer
+    :param data: <bytes> signed payload
+    :param signature: <bytes> DER encoded ECDSA signature
+    :return: <bool>
+    """
+    pub_key_obj = load_public_key(sender)
+    if pub_key_obj is None or not signature:
+        return False
+    try:
+        pub_key_obj.verify(signature, data, ec.ECDSA(hashes.SHA256()))
+    except cryptography.exceptions.InvalidSignature:
+        return False
+    return True
+
+
+def verify_details(details):
+    """
+    Verifies a transaction in its wire form
+    :param details: <dict> with sender, receiver, amount, timestamp and hex signature
+    :return: <bool>
+    """
+    if details['sender'] == 'System':
+        return True
+    signature = details.get('signature')
+    if not signature:
+        return False
+    try:
+        signature = bytes.fromhex(signature)
+    except ValueError:
+        return False
+    return verify_signature(details['sender'],
+                            signing_payload(details['sender'], details['receiver'], details['amount'],
+                                            details['timestamp']),
+                            signature)
+
+
+def _verify_batch(batch):
+    # runs in the worker processes, each of them keeps its own public key cache
+    return [verify_details(details) for details in batch]
+
+
+def _transactions_of(block):
+    if hasattr(block, 'get_details'):
+        block = block.get_details()
+    return block['transactions']
+
+
+class SignatureVerifier(object):
+    """
+    Verifies the signatures of whole blocks or chains in their wire form.
+    Small jobs run inline, larger ones are split in batches over a process pool.
+    """
+    # worker processes, defaults to the number of cores
+    workers = os.cpu_count() or 1
+
+    # transactions sent to a worker at a time
+    batch_size = 256
+
+    # below this many transactions the signatures are checked inline
+    min_parallel = 512
+
+    def __init__(self, workers=None):
+        self.workers = workers or self.workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    @metrics.timed(metrics.SIGNATURE_SECONDS)
+    def verify_transactions(self, transactions):
+        """
+        :param transactions: <list> of transaction dicts or Transaction objects
+        :return: <list> of <bool>, one per transaction
+        """
+        transactions = [t.get_details() if hasattr(t, 'get_details') else t for t in transactions]
+        if self.workers <= 1 or len(transactions) < self.min_parallel:
+            return _verify_batch(transactions)
+
+        batches = [transactions[i:i + self.batch_size] for i in range(0, len(transactions), self.batch_size)]
+        results = []
+        for batch_result in self._get_pool().map(_verify_batch, batches):
+            results.extend(batch_result)
+        return results
+
+    def verify_chain(self, chain):
+        """
+        Verifies the transactions of many blocks in one parallel job
+        :param chain: <list> of Block or their get_details() dicts
+        :return: <list> of <list> of <bool>, the results of every block
+        """
+        per_block = [_transactions_of(block) for block in chain]
+        flat = self.verify_transactions([t for transactions in per_block for t in transactions])
+        results = []
+        start = 0
+        for transactions in per_block:
+            results.append(flat[start:start + len(transactions)])
+            start += len(transactions)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
@@ -0,0 +1,441 @@
+"""
+Compact, versioned binary encoding of blocks, headers and transactions.
+
+Every message starts with the magic b'SBC', a version byte and a message type byte.
+Integers are fixed width big endian, wallet addresses that are hex encoded keys,
+hashes and signatures travel as raw bytes. Decoding reads straight from a
+memoryview of the payload and returns the same dicts as the JSON API.
+Lists of blocks are streamed: every item is preceded by a tag and an end tag
+closes the list, so the sender doesn't need to know the number of items up front.
+"""
+from functools import wraps
+import json
+import struct
+
+CONTENT_TYPE = 'application/x-simplechain'
+
+# Accept header of nodes that prefer the binary format but understand JSON
+ACCEPT = f'{CONTENT_TYPE}, application/json;q=0.5'
+
+MAGIC = b'SBC'
+VERSION = 2
+
+MSG_BLOCK = 1
+MSG_TRANSACTION = 2
+MSG_CHAIN = 3
+MSG_HEADERS = 4
+MSG_REGISTRATION = 5
+
+# address tags
+ADDR_SYSTEM = 0
+ADDR_HEX = 1
+ADDR_TEXT = 2
+
+# number tags, used for amounts and timestamps so ints and floats round-trip exactly
+NUM_INT = 0
+NUM_FLOAT = 1
+NUM_JSON = 2
+NUM_NONE = 3
+
+# list tags, every streamed item is preceded by LIST_ITEM and the list ends with LIST_END
+LIST_END = 0
+LIST_ITEM = 1
+
+# previous hash tags, the genesis block links to the integer 1
+PREV_HASH = 0
+PREV_INT = 1
+PREV_JSON = 2
+
+_PREAMBLE = struct.Struct('>3sBB')
+_U8 = struct.Struct('>B')
+_U16 = struct.Struct('>H')
+_U32 = struct.Struct('>I')
+_U64 = struct.Struct('>Q')
+_I64 = struct.Struct('>q')
+_F64 = struct.Struct('>d')
+
+
+class WireError(ValueError):
+    pass
+
+
+def is_binary(content_type):
+    """
+    :param content_type: <str> Content-Type header, may be None
+    :return: <bool> True if it names the binary format
+    """
+    return bool(content_type) and content_type.split(';')[0].strip() == CONTENT_TYPE
+
+
+def _raw_hex(value, size=None):
+    """
+    :return: <bytes> if value is lowercase hex that round-trips exactly, else None
+    """
+    if not isinstance(value, str) or len(value) % 2:
+        return None
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return None
+    if raw.hex() != value or (size is not None and len(raw) != size):
+        return None
+    return raw
+
+
+class _Writer(object):
+    def __init__(self, message_type):
+        self.buf = bytearray(_PREAMBLE.pack(MAGIC, VERSION, message_type))
+
+    def u8(self, value):
+        self.buf += _U8.pack(value)
+
+    def u16(self, value):
+        self.buf += _U16.pack(value)
+
+    def u32(self, value):
+        self.buf += _U32.pack(value)
+
+    def u64(self, value):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise WireError(f'expected an unsigned integer, got {value!r}')
+        self.buf += _U64.pack(value)
+
+    def blob(self, value, width=_U16):
+        self.buf += width.pack(len(value))
+        self.buf += value
+
+    def text(self, value):
+        self.blob(value.encode())
+
+    def number(self, value):
+        if value is None:
+            self.u8(NUM_NONE)
+        elif isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63:
+            self.u8(NUM_INT)
+            self.buf += _I64.pack(value)
+        elif isinstance(value, float):
+            self.u8(NUM_FLOAT)
+            self.buf += _F64.pack(value)
+        else:
+            self.u8(NUM_JSON)
+            self.text(json.dumps(value))
+
+    def address(self, value):
+        if value == 'System':
+            self.u8(ADDR_SYSTEM)
+            return
+        raw = _raw_hex(value)
+        if raw is not None:
+            self.u8(ADDR_HEX)
+            self.blob(raw)
+        else:
+            self.u8(ADDR_TEXT)
+            self.text(value)
+
+    def previous_hash(self, value):
+        raw = _raw_hex(value, 32)
+        if raw is not None:
+            self.u8(PREV_HASH)
+            self.buf += raw
+        elif isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63:
+            self.u8(PREV_INT)
+            self.buf += _I64.pack(value)
+        else:
+            self.u8(PREV_JSON)
+            self.text(json.dumps(value))
+
+    def hash32(self, value):
+        raw = _raw_hex(value, 32)
+        if raw is None:
+            raise WireError(f'expected a 32 byte hex hash, got {value!r}')
+        self.buf += raw
+
+    def transaction(self, details):
+        self.address(details['sender'])
+        self.address(details['receiver'])
+        self.number(details['amount'])
+        self.number(details['timestamp'])
+        signature = details.get('signature')
+        self.blob(bytes.fromhex(signature) if signature else b'', _U8)
+
+    def block(self, details):
+        self.u64(details['index'])
+        self.number(details['timestamp'])
+        self.u64(details['proof'])
+        self.previous_hash(details['previous_hash'])
+        self.u32(len(details['transactions']))
+        for tr in details['transactions']:
+            self.transaction(tr)
+
+    def header(self, header):
+        self.u64(header['index'])
+        self.number(header['timestamp'])
+        self.hash32(header['merkle_root'])
+        self.u64(header['proof'])
+        self.previous_hash(header['previous_hash'])
+        self.hash32(header['hash'])
+
+
+class _Reader(object):
+    # struct errors of truncated messages are turned into WireError by the decode functions,
+    # the hot paths don't check bounds themselves
+    def __init__(self, data, message_type):
+        self.view = memoryview(data)
+        self.offset = 0
+        if len(self.view) < _PREAMBLE.size:
+            raise WireError('not a binary chain message')
+        magic, version, found_type = _PREAMBLE.unpack_from(self.view, 0)
+        if magic != MAGIC:
+            raise WireError('not a binary chain message')
+        if version != VERSION:
+            raise WireError(f'unsupported wire format version {version}')
+        if found_type != message_type:
+            raise WireError(f'expected message type {message_type}, got {found_type}')
+        self.offset = _PREAMBLE.size
+
+    def _take(self, size):
+        start = self.offset
+        end = start + size
+        if end > len(self.view):
+            raise WireError('truncated message')
+        self.offset = end
+        return self.view[start:end]
+
+    def u8(self):
+        value = self.view[self.offset]
+        self.offset += 1
+        return value
+
+    def u32(self):
+        value = _U32.unpack_from(self.view, self.offset)[0]
+        self.offset += 4
+        return value
+
+    def u64(self):
+        value = _U64.unpack_from(self.view, self.offset)[0]
+        self.offset += 8
+        return value
+
+    def blob(self, width=_U16):
+        size = width.unpack_from(self.view, self.offset)[0]
+        self.offset += width.size
+        return self._take(size)
+
+    def text(self):
+        return str(self.blob(), 'utf-8')
+
+    def number(self):
+        tag = self.u8()
+        if tag == NUM_FLOAT:
+            value = _F64.unpack_from(self.view, self.offset)[0]
+            self.offset += 8
+            return value
+        if tag == NUM_INT:
+            value = _I64.unpack_from(self.view, self.offset)[0]
+            self.offset += 8
+            return value
+        if tag == NUM_JSON:
+            return json.loads(self.text())
+        if tag == NUM_NONE:
+            return None
+        raise WireError(f'unknown number tag {tag}')
+
+    def address(self):
+        tag = self.u8()
+        if tag == ADDR_HEX:
+            return self.blob().hex()
+        if tag == ADDR_SYSTEM:
+            return 'System'
+        if tag == ADDR_TEXT:
+            return self.text()
+        raise WireError(f'unknown address tag {tag}')
+
+    def previous_hash(self):
+        tag = self.u8()
+        if tag == PREV_HASH:
+            return self._take(32).hex()
+        if tag == PREV_INT:
+            value = _I64.unpack_from(self.view, self.offset)[0]
+            self.offset += 8
+            return value
+        if tag == PREV_JSON:
+            return json.loads(self.text())
+        raise WireError(f'unknown previous hash tag {tag}')
+
+    def transaction(self):
+        sender = self.address()
+        receiver = self.address()
+        amount = self.number()
+        timestamp = self.number()
+        signature = self.blob(_U8)
+        return {
+            'sender': sender,
+            'receiver': receiver,
+            'amount': amount,
+            'timestamp': timestamp,
+            'signature': signature.hex() if len(signature) else None
+        }
+
+    def block(self):
+        index = self.u64()
+        timestamp = self.number()
+        proof = self.u64()
+        previous_hash = self.previous_hash()
+        transactions = [self.transaction() for _ in range(self.u32())]
+        return {
+            'index': index,
+            'timestamp': timestamp,
+            'transactions': transactions,
+            'proof': proof,
+            'previous_hash': previous_hash
+        }
+
+    def header(self):
+        return {
+            'index': self.u64(),
+            'timestamp': self.number(),
+            'merkle_root': self._take(32).hex(),
+            'proof': self.u64(),
+            'previous_hash': self.previous_hash(),
+            'hash': self._take(32).hex()
+        }
+
+    def items(self, read):
+        items = []
+        while True:
+            tag = self.u8()
+            if tag == LIST_END:
+                return items
+            if tag != LIST_ITEM:
+                raise WireError(f'unknown list tag {tag}')
+            items.append(read())
+
+    def done(self):
+        if self.offset != len(self.view):
+            raise WireError('trailing bytes after the message')
+
+
+def _decoder(decode):
+    @wraps(decode)
+    def wrapper(data, *args):
+        try:
+            return decode(data, *args)
+        except (struct.error, IndexError, ValueError) as exp:
+            if isinstance(exp, WireError):
+                raise
+            raise WireError(f'malformed message: {exp}')
+    return wrapper
+
+
+def encode_transaction(details):
+    """
+    :param details: <dict> get_details() of a transaction
+    :return: <bytes>
+    """
+    writer = _Writer(MSG_TRANSACTION)
+    writer.transaction(details)
+    return bytes(writer.buf)
+
+
+@_decoder
+def decode_transaction(data):
+    """
+    :param data: <bytes> or <memoryview>
+    :return: <dict> as returned by Transaction.get_details()
+    """
+    reader = _Reader(data, MSG_TRANSACTION)
+    details = reader.transaction()
+    reader.done()
+    return details
+
+
+def encode_block(details):
+    """
+    :param details: <dict> get_details() of a block
+    :return: <bytes>
+    """
+    writer = _Writer(MSG_BLOCK)
+    writer.block(details)
+    return bytes(writer.buf)
+
+
+@_decoder
+def decode_block(data):
+    """
+    :param data: <bytes> or <memoryview>
+    :return: <dict> as returned by Block.get_details()
+    """
+    reader = _Reader(data, MSG_BLOCK)
+    details = reader.block()
+    reader.done()
+    return details
+
+
+def iter_encode_chain(blocks, length, headers_only=False):
+    """
+    Encodes a /chain response block by block
+    :param blocks: iterable of block dicts, or of header dicts when headers_only
+    :param length: <int> length of the whole chain
+    :return: generator of <bytes>
+    """
+    writer = _Writer(MSG_HEADERS if headers_only else MSG_CHAIN)
+    writer.u64(length)
+    yield bytes(writer.buf)
+    for block in blocks:
+        writer.buf = bytearray()
+        writer.u8(LIST_ITEM)
+        if headers_only:
+            writer.header(block)
+        else:
+            writer.block(block)
+        yield bytes(writer.buf)
+    yield _U8.pack(LIST_END)
+
+
+@_decoder
+def decode_chain(data, headers_only=False):
+    """
+    :param data: <bytes> or <memoryview>
+    :return: <dict> {'chain': [...], 'length': <int>} like the JSON /chain response
+    """
+    reader = _Reader(data, MSG_HEADERS if headers_only else MSG_CHAIN)
+    length = reader.u64()
+    chain = reader.items(reader.header if headers_only else reader.block)
+    reader.done()
+    return {'chain': chain, 'length': length}
+
+
+def iter_encode_registration(peer_nodes, blocks, length):
+    """
+    Encodes a /nodes/register response block by block
+    :param peer_nodes: <list> of <str>
+    :param blocks: iterable of block dicts
+    :param length: <int> length of the whole chain
+    :return: generator of <bytes>
+    """
+    writer = _Writer(MSG_REGISTRATION)
+    writer.u32(len(peer_nodes))
+    for node in peer_nodes:
+        writer.text(node)
+    writer.u64(length)
+    yield bytes(writer.buf)
+    for block in blocks:
+        writer.buf = bytearray()
+        writer.u8(LIST_ITEM)
+        writer.block(block)
+        yield bytes(writer.buf)
+    yield _U8.pack(LIST_END)
+
+
+@_decoder
+def decode_registration(data):
+    """
+    :param data: <bytes> or <memoryview>
+    :return: <dict> {'peer_nodes': [...], 'blockchain': {'chain': [...], 'length': <int>}}
+    """
+    reader = _Reader(data, MSG_REGISTRATION)
+    peer_nodes = [reader.text() for _ in range(reader.u32())]
+    length = reader.u64()
+    chain = reader.items(reader.block)
+    reader.done()
+    return {'peer_nodes': peer_nodes, 'blockchain': {'chain': chain, 'length': length}}